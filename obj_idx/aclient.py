@@ -0,0 +1,171 @@
+"""asyncio counterparts of the client upload and download helpers
+
+API calls are non-blocking via aclilib; hashing and S3 transfers still use
+boto3 and hashlib so they run in worker threads, bounded by semaphores.
+"""
+
+import asyncio
+import pathlib
+import socket
+import warnings
+import aiohttp
+from . import aclilib, client, fetch, hashcache, s3lib
+
+def get_obj_idx(url, user, limit=aclilib.CONCURRENCY) -> aclilib.AsyncObjectIndex:
+    """Get AsyncObjectIndex object; use it as an async context manager"""
+    return aclilib.AsyncObjectIndex(url, host=socket.gethostname(), sw=client.SW_STRING,
+                                    user=user, limit=limit)
+
+async def keep_lease(fileobj: aclilib.AsyncFile):
+    """Renew an AsyncFile's upload lease every third of its ttl until cancelled
+
+    Returns, so the task is done, only if a renewal is refused as the lease was lost
+    """
+    while True:
+        await asyncio.sleep(fileobj.lease['ttl'] / 3)
+        try:
+            await fileobj.oio.renew_lease(fileobj.info['file_object']['uuid'], fileobj.lease['id'])
+        except aiohttp.ClientResponseError as e:
+            if e.status == 409:
+                return
+            warnings.warn(f"Could not renew lease for {fileobj.uuid}: {e}")
+        except aiohttp.ClientError as e:
+            warnings.warn(f"Could not renew lease for {fileobj.uuid}: {e}")
+
+async def release_lease(fileobj: aclilib.AsyncFile):
+    """Give up an AsyncFile's upload lease after a failed upload, warning if that fails"""
+    try:
+        await fileobj.oio.release_lease(fileobj.info['file_object']['uuid'], fileobj.lease['id'])
+    except aiohttp.ClientError as e:
+        # NOTE it still runs out after its ttl
+        warnings.warn(f"Could not release lease for {fileobj.uuid}: {e}")
+
+async def run_job(obj_idx: aclilib.AsyncObjectIndex,
+                  job: client.UploadJob,
+                  hashers: asyncio.Semaphore,
+                  transfers: asyncio.Semaphore,
+                  cache: hashcache.ChecksumCache = None) -> client.UploadJob:
+    """Hash, register and transfer one UploadJob; errors are recorded on the job"""
+    try:
+        async with hashers:
+            await asyncio.to_thread(client.hash_job, job, cache)
+        try:
+            # NOTE no resume; multipart progress tracking is only in the threaded client
+            with client.phase(job, 'register'):
+                job.file = await obj_idx.initiate_upload(**{**client.upload_args(job),
+                                                            'resume': False})
+        except aiohttp.ClientResponseError as e:
+            if e.status != 409:
+                raise e
+            job.conflict = aclilib.conflict_uuid(e)
+            return job
+        if not job.file.exists():
+            keeper = asyncio.create_task(keep_lease(job.file)) if job.file.lease else None
+            try:
+                s3_url = await job.file.get_s3_url()
+                async with transfers:
+                    if keeper and keeper.done():
+                        raise ValueError(f"Upload lease on {job.file.uuid} was lost while queued")
+                    with client.phase(job, 'transfer', job.stat.st_size):
+                        await asyncio.to_thread(_put, job.filename, s3_url)
+                with client.phase(job, 'finish'):
+                    await job.file.finish_upload()
+            except Exception:
+                if keeper and not keeper.done():
+                    keeper.cancel()
+                    await release_lease(job.file)
+                raise
+            finally:
+                if keeper:
+                    keeper.cancel()
+    except Exception as e:  # pylint: disable=broad-except
+        job.error = e
+    return job
+
+def _put(filename, s3_url):
+    bucket = s3lib.s3_service(s3_url['server']).Bucket(s3_url['bucket'])
+    bucket.upload_file(filename, s3_url['key'], Config=s3lib.transfer_config())
+
+async def upload_jobs(obj_idx: aclilib.AsyncObjectIndex,
+                      jobs,
+                      hash_workers: int = 1,
+                      transfer_workers: int = 1,
+                      cache: hashcache.ChecksumCache = None):
+    """Run many UploadJobs from one event loop, yielding them as they finish
+
+    A fixed pool of worker tasks takes jobs as it goes, so only a few are in flight
+    however many jobs there are; an error from the jobs iterable is raised once
+    the jobs already taken are yielded
+    """
+    hashers = asyncio.Semaphore(hash_workers)
+    transfers = asyncio.Semaphore(transfer_workers)
+    jobs = iter(jobs)
+    finished = asyncio.Queue()
+    async def work():
+        try:
+            for job in jobs:
+                await finished.put(await run_job(obj_idx, job, hashers, transfers, cache))
+        finally:
+            await finished.put(None)
+    # NOTE enough that every hash and transfer slot can be busy at once
+    workers = [asyncio.create_task(work()) for _ in range(hash_workers + transfer_workers)]
+    try:
+        remaining = len(workers)
+        while remaining:
+            job = await finished.get()
+            if job is None:
+                remaining -= 1
+                continue
+            yield job
+        await asyncio.gather(*workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
+
+async def upload(filename: str, obj_idx: aclilib.AsyncObjectIndex, bucket: str, tags: dict,
+                 cache: hashcache.ChecksumCache = None) -> aclilib.AsyncFile:
+    """Run an actual file upload into ObjIdx and S3"""
+    job = await run_job(obj_idx, client.UploadJob(filename, bucket, extra=tags),
+                        asyncio.Semaphore(), asyncio.Semaphore(), cache)
+    if job.error:
+        raise job.error
+    return job.file
+
+async def download(obj_idx: aclilib.AsyncObjectIndex,
+                   url: str,
+                   pretend: bool = False,
+                   transfers: asyncio.Semaphore = None,
+                   output_dir: str = '.',
+                   jobs: int = 1,
+                   chunk_size: int = fetch.CHUNK_SIZE) -> list[aclilib.AsyncFile]:
+    """Download a file with given original URL
+
+    As client.download_files: each object once, under output_dir named by S3 key
+    and verified against its checksum, skipping files without an uploaded object
+    """
+    files = await obj_idx.search_files({'url': url})
+    if pretend:
+        return files
+    if not transfers:
+        transfers = asyncio.Semaphore()
+    objects = {}
+    for file in files:
+        if client.downloadable(file):
+            objects.setdefault(file.object['uuid'], file)
+    async def one(file):
+        s3_url = await file.get_s3_url()
+        async with transfers:
+            await asyncio.to_thread(fetch.download_object, s3_url,
+                                    bytes.fromhex(file.object['checksum']),
+                                    file.object['obj_size'],
+                                    pathlib.Path(output_dir, s3_url['key']),
+                                    jobs, chunk_size)
+    await asyncio.gather(*(one(file) for file in objects.values()))
+    return files
+
+async def search_many(obj_idx: aclilib.AsyncObjectIndex, urls):
+    """Look up many source URLs concurrently, yielding (url, files) as answers come in"""
+    async def one(url):
+        return url, await obj_idx.search_files({'url': url})
+    for task in asyncio.as_completed([one(url) for url in urls]):
+        yield await task
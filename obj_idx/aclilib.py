@@ -0,0 +1,172 @@
+"""ObjectIndex client library for asyncio
+
+Mirrors clilib on top of aiohttp; install with the objectindex[async] extra
+"""
+
+import asyncio
+import json
+import uuid
+from urllib.parse import urljoin
+import aiohttp
+from . import clilib
+
+CONCURRENCY = 32
+
+
+class AsyncFile(clilib.File):
+    """An ObjectIndex 'file' whose API calls are coroutines"""
+    async def get_s3_url(self):
+        """Return S3 object URL"""
+        if not self.s3_url:
+            self.s3_url = await self.oio.get(urljoin(self.get_object_url(), 'download'))
+        return self.s3_url
+    async def finish_upload(self):
+        """Declare that an upload of this file is finished"""
+        assert self.object_url
+        self.object = await self.oio.put(self.object_url, json={"completed": True})
+        assert self.object['completed']
+
+
+class AsyncObjectIndex:
+    """Interface with an ObjectIndex API instance from asyncio
+
+    Use as an async context manager; at most limit calls are in flight at once
+    """
+    def __init__(self, url, user=None, sw=None, host=None, limit=CONCURRENCY):
+        self.url = url
+        self.user = user
+        self.sw = sw
+        self.host = host
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        """Start the HTTP session"""
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit))
+
+    async def close(self):
+        """Close the HTTP session"""
+        await self.session.close()
+
+    async def send(self, method, url, **kwargs) -> tuple:
+        """Run an API call and return the decoded JSON and the response headers
+
+        Errors raise aiohttp.ClientResponseError with the response body as message
+        """
+        async with self.semaphore:
+            async with self.session.request(method, urljoin(self.url, url), **kwargs) as result:
+                if result.status >= 400:
+                    raise aiohttp.ClientResponseError(result.request_info,
+                                                      result.history,
+                                                      status=result.status,
+                                                      message=await result.text())
+                return await result.json(), result.headers
+
+    async def request(self, method, url, **kwargs):
+        """Run an API call and return the decoded JSON"""
+        return (await self.send(method, url, **kwargs))[0]
+
+    async def put(self, url, json):
+        """Run an API PUT/PATCH"""
+        return await self.request('PUT', url, json=json)
+
+    async def post(self, url, json):
+        """Run an API POST"""
+        return await self.request('POST', url, json=json)
+
+    async def renew_lease(self, object_uuid, lease_id) -> dict:
+        """Extend the upload lease on an object; ClientResponseError 409 if it was lost"""
+        return await self.put(f"object/{object_uuid}/lease", json={"id": str(lease_id)})
+
+    async def release_lease(self, object_uuid, lease_id) -> dict:
+        """Give up the upload lease on an object so another upload can take it over now"""
+        return await self.request('DELETE', f"object/{object_uuid}/lease",
+                                  params={"id": str(lease_id)})
+
+    async def get(self, url, params=None):
+        """Run an API GET"""
+        if params:
+            params = {key: value for key, value in params.items() if value is not None}
+        return await self.request('GET', url, params=params)
+
+    upload_payload = clilib.ObjectIndex.upload_payload
+
+    def _upload_file(self, info: dict) -> AsyncFile:
+        """Make an AsyncFile out of an UploadResult"""
+        fileobj = AsyncFile(self, uuid.UUID(info['file']['uuid']))
+        fileobj.set_info(info['file'])
+        fileobj.set_upload(exists=info['exists'],
+                           s3_url=(info['download'] if info['exists'] else info['upload']['s3']),
+                           object_url=(None if info['exists'] else info['upload']['finished']),
+                           multipart=info.get('multipart'),
+                           lease=info.get('lease'))
+        return fileobj
+
+    async def initiate_upload(self, **kwargs) -> AsyncFile:
+        """Kick off an upload; takes the same arguments as ObjectIndex.initiate_upload"""
+        return self._upload_file(await self.post('upload/', json=self.upload_payload(**kwargs)))
+
+    async def search_files_page(self, params, cursor=None, limit=None) -> tuple:
+        """Get one page of a file search as a list of AsyncFile and the next cursor"""
+        params = {key: value for key, value in params.items() if value is not None}
+        if cursor:
+            params['cursor'] = cursor
+        if limit:
+            params['limit'] = limit
+        info, headers = await self.send('GET', 'file/', params=params)
+        files = []
+        for file in info:
+            file_obj = AsyncFile(self, file['uuid'])
+            file_obj.set_info(file)
+            files.append(file_obj)
+        return files, headers.get('X-Next-Cursor')
+
+    async def search_files(self, params, limit=None) -> list[AsyncFile]:
+        """Search for files with given parameters, following all pages"""
+        files = []
+        cursor = None
+        while True:
+            page, cursor = await self.search_files_page(params, cursor, limit)
+            files.extend(page)
+            if not cursor:
+                return files
+
+    async def get_file(self, fileid, with_info=True) -> AsyncFile:
+        """Get file object for given UUID"""
+        myfile = AsyncFile(self, fileid)
+        if with_info:
+            myfile.set_info(await self.get(f"file/{fileid}"))
+        return myfile
+
+    async def get_object(self, objid):
+        """Get object dictionary for given UUID"""
+        return await self.get(f"object/{objid}/")
+
+    async def search_object(self, checksum):
+        """Get all objects with given checksum"""
+        return await self.get("object/", params={'checksum': checksum})
+
+    async def get_presigned(self, objid):
+        """Get presigned URL for a given object"""
+        return (await self.get(f"object/{objid}/download", params={"presigned": "true"}))["presigned"]
+
+    async def get_presigned_many(self, objids, expires=None) -> dict:
+        """Get presigned URLs for many objects in one call, as a dict by object UUID"""
+        payload = {"objects": [str(objid) for objid in objids]}
+        if expires:
+            payload["expires"] = expires
+        return {info['uuid']: info['presigned']
+                for info in await self.post('object/presigned', json=payload)}
+
+
+def conflict_uuid(error: aiohttp.ClientResponseError) -> str:
+    """Object UUID from a 409 raised by AsyncObjectIndex.request"""
+    return json.loads(error.message)['object_uuid']
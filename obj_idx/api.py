@@ -1,13 +1,35 @@
 """Library Media Person RESTful API"""
 
+import base64
+import binascii
+import datetime
+import hashlib
+import json
+import math
 import uuid
+import flask
 import flask_restx
+import sqlalchemy
+import sqlalchemy.orm
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from . import app
 from . import db
+from . import fastjson
+from . import lrucache
+from . import metrics
 from . import s3lib
 
 ACCEPT_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.-_"
 REPLACE_CHAR = "_"
+PAGE_LIMIT = 1000
+MAX_PAGE_LIMIT = 10000
+STREAM_BATCH = 1000
+CACHE_SIZE = 1024
+CACHE_TTL = 60
+IMMUTABLE = 'public, max-age=31536000, immutable'
+PRESIGN_EXPIRES = 3600
+MAX_PRESIGN = 10000
+LEASE_TTL = 600
 
 def sanitize_filename(requested_name):
     """Santize a filename into a usable key"""
@@ -32,6 +54,19 @@ uplns = api.namespace('upload', description='Upload operations')
 filns = api.namespace('file', description='File operations')
 objns = api.namespace('object', description='Object operations')
 
+UPLOADS = metrics.Counter('objidx_uploads_total', 'Upload registrations by outcome', ('status', ))
+PRESIGN_SECONDS = metrics.Histogram('objidx_presign_duration_seconds',
+                                    'Time to presign a download URL')
+if metrics.instrument(app, 'api'):
+    metrics.instrument_sqlalchemy()
+    # NOTE checked out near size plus max overflow means requests queue for connections
+    metrics.Gauge('objidx_db_pool_checked_out', 'Database connections in use',
+                  lambda: db.db.engine.pool.checkedout())
+    metrics.Gauge('objidx_db_pool_size', 'Database connections kept open',
+                  lambda: db.db.engine.pool.size())
+    metrics.Gauge('objidx_db_pool_overflow', 'Database connections open beyond the pool size',
+                  lambda: db.db.engine.pool.overflow())
+
 # TODO add link to full file URL (i.e. GET /file/abcd)
 abf = api.model('BriefFile', {'uuid': flask_restx.fields.String(readonly=True),
                               'url': flask_restx.fields.String(readonly=True)})
@@ -55,7 +90,8 @@ upl = api.model('UploadSub', {'mtime': flask_restx.fields.DateTime(),
                               'bucket':  flask_restx.fields.String(required=True),
                               'obj_size': flask_restx.fields.Integer(required=True),
                               'checksum':  flask_restx.fields.String(required=True),
-                              'mime':  flask_restx.fields.String()})
+                              'mime':  flask_restx.fields.String(),
+                              'resume': flask_restx.fields.Boolean(default=False)})
 obj = api.model('Object', {'ctime': flask_restx.fields.DateTime(readonly=True),
                            'files': flask_restx.fields.List(flask_restx.fields.Nested(abf)),
                            #'url': flask_restx.fields.String(required=True),
@@ -67,6 +103,8 @@ obj = api.model('Object', {'ctime': flask_restx.fields.DateTime(readonly=True),
                            'obj_size': flask_restx.fields.Integer(readonly=True),
                            'checksum':  Checksum(readonly=True),
                            'mime':  flask_restx.fields.String(),
+                           'verified': flask_restx.fields.DateTime(readonly=True),
+                           'verify_ok': flask_restx.fields.Boolean(readonly=True),
                            'uuid': flask_restx.fields.String(readonly=True)})
 fil = api.model('File',  {'mtime': flask_restx.fields.DateTime(),
                           'url': flask_restx.fields.String(readonly=True),
@@ -79,11 +117,160 @@ fil = api.model('File',  {'mtime': flask_restx.fields.DateTime(),
                           'file_object': flask_restx.fields.Nested(obj),
                           'uuid': flask_restx.fields.String(readonly=True),
                           'ctime': flask_restx.fields.DateTime(readonly=True)})
+mpp = api.model('MultipartPart', {'number': flask_restx.fields.Integer(required=True),
+                                  'etag': flask_restx.fields.String(required=True),
+                                  'size': flask_restx.fields.Integer(required=True),
+                                  'upload_id': flask_restx.fields.String()})
+mpu = api.model('MultipartUpload', {'upload_id': flask_restx.fields.String(attribute='mpu_id',
+                                                                          required=True),
+                                    'part_size': flask_restx.fields.Integer(attribute='mpu_part_size',
+                                                                           required=True),
+                                    'parts': flask_restx.fields.List(flask_restx.fields.Nested(mpp),
+                                                                     readonly=True)})
+lse = api.model('Lease', {'id': flask_restx.fields.String(required=True),
+                          'expires': flask_restx.fields.DateTime(readonly=True),
+                          'ttl': flask_restx.fields.Integer(readonly=True)})
+stg = api.model('StagingRequest', {'bucket':  flask_restx.fields.String(required=True),
+                                   'filename': flask_restx.fields.String()})
 ulr = api.model('UploadResult', {'file': flask_restx.fields.Nested(fil),
                                  'exists': flask_restx.fields.Boolean(),
                                  'upload': flask_restx.fields.Nested(ull),
+                                 'multipart': flask_restx.fields.Nested(mpu, allow_null=True),
+                                 'lease': flask_restx.fields.Nested(lse, allow_null=True),
                                  'download': flask_restx.fields.Nested(s3l, readonly=True)})
+ulb = api.model('UploadBatch', {'uploads': flask_restx.fields.List(flask_restx.fields.Nested(upl),
+                                                                   required=True)})
+ubr = api.inherit('UploadBatchResult', ulr, {'status': flask_restx.fields.String(enum=['exists',
+                                                                                      'upload',
+                                                                                      'resume',
+                                                                                      'conflict',
+                                                                                      'error']),
+                                             'object_uuid': flask_restx.fields.String(),
+                                             'message': flask_restx.fields.String()})
+psr = api.model('PresignRequest', {'objects': flask_restx.fields.List(flask_restx.fields.String(),
+                                                                     required=True),
+                                   'expires': flask_restx.fields.Integer(default=PRESIGN_EXPIRES)})
+psu = api.model('PresignedURL', {'uuid': flask_restx.fields.String(),
+                                 'presigned': flask_restx.fields.String()})
+
+
+PROJECTION_PARAMS = {'fields': {'description': 'Comma separated fields to return, dotted for nested ones (e.g. uuid,url,file_object.obj_size)',
+                                 'type': 'string'},
+                      'exclude': {'description': 'Comma separated fields to leave out, dotted for nested ones',
+                                  'type': 'string'}}
+
+
+def nested_model(field):
+    """Model inside a Nested or List(Nested) field, else None"""
+    if isinstance(field, flask_restx.fields.List):
+        field = field.container
+    if isinstance(field, flask_restx.fields.Nested):
+        return field.nested
+    return None
+
+def project(model, fields=None, exclude=None, prefix=''):
+    """Narrow a model to the given field names
+
+    fields and exclude are sets of names, dotted for fields of nested models;
+    naming a nested field in fields keeps all of it
+    """
+    result = {}
+    for name, field in model.items():
+        path = prefix + name
+        if exclude and path in exclude:
+            continue
+        nested = nested_model(field)
+        sub_fields = fields
+        if fields and path not in fields:
+            if nested is None or not any(wanted.startswith(f"{path}.") for wanted in fields):
+                continue
+        elif fields:
+            sub_fields = None
+        if nested is not None and (sub_fields or exclude):
+            sub_model = project(nested, sub_fields, exclude, f"{path}.")
+            if isinstance(field, flask_restx.fields.List):
+                field = flask_restx.fields.List(flask_restx.fields.Nested(sub_model))
+            else:
+                field = flask_restx.fields.Nested(sub_model)
+        result[name] = field
+    return result
+
+def projection(model):
+    """Model narrowed by the fields= and exclude= request arguments"""
+    parser = flask_restx.reqparse.RequestParser()
+    parser.add_argument('fields')
+    parser.add_argument('exclude')
+    args = parser.parse_args()
+    if not (args.fields or args.exclude):
+        return model
+    return project(model,
+                   set(args.fields.split(',')) if args.fields else None,
+                   set(args.exclude.split(',')) if args.exclude else None)
+
+# Loading matching what a (projected) model marshals: extra is deferred, so only
+# undeferred when asked for, and nested rows are loaded eagerly so marshalling any
+# number of rows takes a constant number of queries
+
+def object_load(model, via=()):
+    """Loader options for Object rows marshalled with model
+
+    via is the relationship path leading to the objects when they are nested
+    """
+    def start():
+        return sqlalchemy.orm.defaultload(*via) if via else sqlalchemy.orm
+    options = []
+    if 'extra' in model:
+        options.append(start().undefer(db.Object.extra))
+    if 'files' in model:
+        options.append(start().selectinload(db.Object.files))
+    return options
+
+def file_load(model):
+    """Loader options for File rows marshalled with model"""
+    options = []
+    if 'extra' in model:
+        options.append(sqlalchemy.orm.undefer(db.File.extra))
+    obj_model = nested_model(model.get('file_object'))
+    if obj_model is not None:
+        options.append(sqlalchemy.orm.joinedload(db.File.file_object))
+        options.extend(object_load(obj_model, (db.File.file_object, )))
+    return options
+
+# NOTE per process, so with several workers another one may serve a stale entry
+#      until it expires; each process drops entries for objects it changes itself
+lookup_cache = lrucache.LRUCache(app.config.get('OBJIDX_CACHE_SIZE', CACHE_SIZE),
+                                 app.config.get('OBJIDX_CACHE_TTL', CACHE_TTL))
 
+def invalidate(obj_uuids):
+    """Drop cached responses built from any of the given objects"""
+    lookup_cache.prune(lambda key, entry: entry['obj_uuid'] in obj_uuids)
+
+def cached_response(key, load):
+    """JSON response with an ETag, from lookup_cache or built by load, 304 if not modified
+
+    load returns the data, the object UUID it depends on, and the Cache-Control
+    and Last-Modified values to send (either may be None)
+    """
+    entry = lookup_cache.get(key)
+    if entry is None:
+        data, obj_uuid, cache_control, last_modified = load()
+        body = api.make_response(data, 200).get_data()
+        entry = {'body': body,
+                 'etag': hashlib.sha1(body).hexdigest(),
+                 'obj_uuid': obj_uuid,
+                 'cache_control': cache_control or 'no-cache',
+                 'last_modified': last_modified}
+        lookup_cache.put(key, entry)
+    response = flask.Response(entry['body'], mimetype='application/json')
+    response.set_etag(entry['etag'])
+    response.headers['Cache-Control'] = entry['cache_control']
+    if entry['last_modified']:
+        response.last_modified = entry['last_modified']
+    return response.make_conditional(flask.request)
+
+def projection_key(*key):
+    """lookup_cache key for a resource, including the projection asked for"""
+    return (*key, flask.request.args.get('fields'), flask.request.args.get('exclude'))
 
 def get_dl_url(objobj):
     """Get a URLish list of server, bucket, key"""
@@ -93,84 +280,424 @@ def get_dl_url(objobj):
 
 
 def get_s3_obj():
-    """Get an S3 object"""
-    # TODO cache this?
-    return s3lib.get_s3_client_low(app.config['OBJIDX_S3'])
+    """Get the shared S3 client"""
+    return s3lib.s3_client(app.config['OBJIDX_S3'], app.config.get('OBJIDX_S3_POOL'))
+
+def presigned(s3_obj, my_obj, expires=PRESIGN_EXPIRES):
+    """Presigned download URL for an object, timed for /metrics"""
+    with PRESIGN_SECONDS.time():
+        return s3lib.presigned(s3_obj, my_obj.bucket, my_obj.key, expires=expires)
+
+PAGE_PARAMS = {'limit': {'description': 'Maximum number of results; see X-Next-Cursor for more',
+                          'type': 'integer'},
+               'cursor': {'description': 'X-Next-Cursor value from the previous page',
+                          'type': 'string'}}
+
+def page_parser():
+    """Request parser with the pagination arguments"""
+    parser = flask_restx.reqparse.RequestParser()
+    parser.add_argument('limit', type=int)
+    parser.add_argument('cursor')
+    return parser
+
+# Keyset orderings for paginate(): (attribute, collation, cursor value parser)
+CTIME_KEYS = (('ctime', None, datetime.datetime.fromisoformat), ('uuid', None, uuid.UUID))
+# NOTE C collation so both the prefix LIKE and the ORDER BY can use ix_file_url_c
+URL_KEYS = (('url', 'C', str), ('uuid', None, uuid.UUID))
+
+def parse_cursor(cursor, keys=CTIME_KEYS):
+    """Key values a cursor holds, else abort 400 as the client made it up or mangled it"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError(values)
+        return tuple(parse(value) for (_, _, parse), value in zip(keys, values))
+    except (binascii.Error, ValueError, TypeError):
+        flask_restx.abort(400, "Malformed cursor")
+
+def keyset(query, model, cursor, keys=CTIME_KEYS):
+    """Order a query by keys and start it after cursor, if any"""
+    columns = [getattr(model, name).collate(collation) if collation else getattr(model, name)
+               for name, collation, _ in keys]
+    if cursor:
+        query = query.filter(sqlalchemy.tuple_(*columns) > parse_cursor(cursor, keys))
+    return query.order_by(*columns)
+
+def paginate(query, model, args, keys=CTIME_KEYS):
+    """Keyset pagination of a query, by default by (ctime, uuid)
+
+    The cursor is the last row's key values as base64 JSON.
+    Returns the rows of this page and response headers pointing at the next one
+    """
+    limit = min(args.limit or app.config.get('OBJIDX_PAGE_LIMIT', PAGE_LIMIT),
+                app.config.get('OBJIDX_MAX_PAGE_LIMIT', MAX_PAGE_LIMIT))
+    if limit <= 0:
+        flask_restx.abort(400, "limit must be positive")
+    rows = keyset(query, model, args.cursor, keys).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, {}
+    rows = rows[:limit]
+    next_cursor = base64.urlsafe_b64encode(
+        json.dumps([str(getattr(rows[-1], name)) for name, _, _ in keys]).encode()).decode()
+    next_args = flask.request.args.to_dict(flat=False)
+    next_args['cursor'] = [next_cursor]
+    next_url = flask.url_for(flask.request.endpoint, **next_args)
+    return rows, {'X-Next-Cursor': next_cursor, 'Link': f'<{next_url}>; rel="next"'}
+
+def stream_rows(query, model, args, marshal_model, keys=CTIME_KEYS):
+    """Stream all rows after the cursor as NDJSON instead of one page as a JSON list
+
+    Rows come off a server side cursor and are encoded one at a time, so memory
+    stays flat however many match; limit is optional here and not capped.
+    The response is gzip or zstd compressed if the client accepts it.
+    """
+    query = keyset(query, model, args.cursor, keys)
+    if args.limit:
+        query = query.limit(args.limit)
+    encoding = flask.request.accept_encodings.best_match(fastjson.encodings())
+    headers = {'Content-Encoding': encoding} if encoding else {}
+    body = fastjson.stream(query.yield_per(STREAM_BATCH),
+                           fastjson.row_encoder(marshal_model),
+                           encoding)
+    return flask.Response(flask.stream_with_context(body),
+                          mimetype=fastjson.NDJSON,
+                          headers={'Vary': 'Accept, Accept-Encoding', **headers})
+
+def list_response(query, model, args, marshal_model, keys=CTIME_KEYS):
+    """Response for a list endpoint: NDJSON stream if asked for, else a page"""
+    if flask.request.accept_mimetypes.best_match(['application/json',
+                                                  fastjson.NDJSON]) == fastjson.NDJSON:
+        return stream_rows(query, model, args, marshal_model, keys)
+    rows, headers = paginate(query, model, args, keys)
+    return flask_restx.marshal(rows, marshal_model), 200, headers
+
+def like_prefix(prefix):
+    """LIKE pattern matching strings starting with prefix, with wildcards escaped
+
+    Uses the default backslash escape so Postgres can still turn it into an index range
+    """
+    escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"{escaped}%"
+
+def tag_value(value):
+    """The number or boolean a tag value also stands for, like 3 for '3', else None"""
+    try:
+        decoded = json.loads(value)
+    except ValueError:
+        return None
+    if isinstance(decoded, (bool, int)) or (isinstance(decoded, float) and math.isfinite(decoded)):
+        return decoded
+    return None
+
+def extra_filter(column, tags):
+    """JSONB containment (@>) filter matching all of a list of key=value tags
+
+    Tags go into as few containment tests as possible so a GIN index can serve them.
+    Values come in as text, so one reading as a number or boolean matches either
+    that or the string
+    """
+    wanted = [{}]
+    either = []
+    for tag in tags:
+        key, equals, value = tag.partition('=')
+        if equals != '=':
+            flask_restx.abort(400, f"extra {tag} is not key=value")
+        decoded = tag_value(value)
+        if decoded is not None:
+            either.append(sqlalchemy.or_(column.contains({key: value}),
+                                         column.contains({key: decoded})))
+            continue
+        for cond in wanted:
+            if key not in cond:
+                cond[key] = value
+                break
+        else:
+            # Same key asked for twice; keep AND semantics with a separate test
+            wanted.append({key: value})
+    return sqlalchemy.and_(*(column.contains(cond) for cond in wanted if cond), *either)
 
 # flask_restx.fields.Integer(readonly=True, description='Task ID'),
 
+def lease_ttl():
+    """Seconds an upload lease lasts without renewal"""
+    return app.config.get('OBJIDX_LEASE', LEASE_TTL)
+
+def upsert_objects(rows, now):
+    """INSERT ... ON CONFLICT (checksum) for new object rows
+
+    Only rows inserted, or whose earlier upload was deleted before completing or
+    let its lease run out, come back, with the new lease; the conflict test runs
+    on the latest row version so two uploaders can never both be handed the
+    same object to upload
+    """
+    table = db.Object.__table__
+    insert = pg_insert(table).values(rows)
+    return insert.on_conflict_do_update(
+        index_elements=[table.c.checksum],
+        set_={'deleted': False,
+              'lease_id': insert.excluded.lease_id,
+              'lease_expires': insert.excluded.lease_expires,
+              'mime': sqlalchemy.func.coalesce(table.c.mime, insert.excluded.mime),
+              'extra': sqlalchemy.func.coalesce(table.c.extra, insert.excluded.extra)},
+        # NOTE no lease at all is an upload from before leases existed
+        where=~table.c.completed & (table.c.deleted |
+                                    table.c.lease_expires.is_(None) |
+                                    (table.c.lease_expires < now))).returning(*table.c)
+
+def fill_objects(rows):
+    """UPDATE existing objects filling in missing mime and extra, returning those changed
+
+    Rows already having what the payload offers are left alone
+    """
+    table = db.Object.__table__
+    values = sqlalchemy.values(sqlalchemy.column('checksum', table.c.checksum.type),
+                               sqlalchemy.column('mime', table.c.mime.type),
+                               sqlalchemy.column('extra', table.c.extra.type),
+                               name='v').data([(row['checksum'], row['mime'], row['extra'])
+                                               for row in rows])
+    return (table.update()
+            .where(table.c.checksum == values.c.checksum)
+            .values(mime=sqlalchemy.func.coalesce(table.c.mime, values.c.mime),
+                    # NOTE VALUES params arrive untyped, so cast back to jsonb
+                    extra=sqlalchemy.func.coalesce(table.c.extra,
+                                                   sqlalchemy.cast(values.c.extra, table.c.extra.type)))
+            .where((table.c.mime.is_(None) & values.c.mime.isnot(None)) |
+                   (table.c.extra.is_(None) & values.c.extra.isnot(None)))
+            .returning(*table.c))
+
+def upsert_files(rows):
+    """INSERT ... ON CONFLICT (url, obj_uuid) for file rows, filling in missing mtime and extra"""
+    table = db.File.__table__
+    insert = pg_insert(table).values(rows)
+    return insert.on_conflict_do_update(
+        index_elements=[table.c.url, table.c.obj_uuid],
+        set_={'mtime': sqlalchemy.func.coalesce(table.c.mtime, insert.excluded.mtime),
+              'extra': sqlalchemy.func.coalesce(table.c.extra, insert.excluded.extra)}
+    ).returning(table.c.uuid, table.c.url, table.c.obj_uuid, table.c.direct, table.c.partial)
+
+def upload_error(payload):
+    """Why an upload payload can not be registered, or None if it can"""
+    for field in ('url', 'bucket', 'obj_size', 'checksum'):
+        if payload.get(field) is None:
+            return f"{field} is required"
+    if payload['bucket'] not in app.config['OBJIDX_BUCKETS']:
+        return f"Bucket {payload['bucket']} is not indexed here"
+    try:
+        bytes.fromhex(payload['checksum'])
+    except (TypeError, ValueError):
+        return "Checksum is not hex"
+    return None
+
+def register_uploads(payloads):
+    """Find or create the objects and files for a list of upload payloads
+
+    Built on the unique checksum and (url, obj_uuid) indexes: objects take one
+    INSERT ... ON CONFLICT plus an UPDATE for existing ones missing mime or extra,
+    files one more upsert, all in a single transaction and in key order, so
+    parallel uploaders stay consistent and do not deadlock.
+    Returns a list of (status, object, file) in payload order; status is 'exists',
+    'upload', 'conflict' (file is None for a conflict, including objects deleted after
+    completing or of another size), 'error' (object is None and file the reason) or,
+    for payloads asking to resume and taking over an expired lease with a multipart
+    upload, 'resume'
+    """
+    errors = [upload_error(payload) for payload in payloads]
+    checksums = [None if error else bytes.fromhex(payload['checksum'])
+                 for payload, error in zip(payloads, errors)]
+    now = datetime.datetime.utcnow()
+    new_objects = {}
+    for payload, checksum in zip(payloads, checksums):
+        if checksum is None:
+            continue
+        # NOTE ON CONFLICT can not touch a row twice in one statement; first one wins
+        new_objects.setdefault(checksum, {
+            'uuid': uuid.uuid1(),
+            'bucket': payload['bucket'],
+            'key': f"{checksum.hex()}-{sanitize_filename(payload['filename'])}",
+            'obj_size': payload['obj_size'],
+            'checksum': checksum,
+            'ctime': datetime.datetime.utcnow(),
+            'mime': payload.get('mime'),
+            'completed': False,
+            'deleted': False,
+            'lease_id': uuid.uuid4(),
+            'lease_expires': now + datetime.timedelta(seconds=lease_ttl()),
+            'extra': payload.get('extra_object')})
+    # NOTE sorted so concurrent batches lock rows in the same order and cannot deadlock
+    rows = sorted(new_objects.values(), key=lambda row: row['checksum'])
+    objects = {}
+    if rows:
+        objects = {row.checksum: row for row in db.db.session.execute(upsert_objects(rows, now))}
+    claimed = set(objects)  # checksums this batch gets to (re)upload
+    # NOTE the upsert locked the existing rows too, even those it did not update
+    existing = [row for row in rows if row['checksum'] not in claimed]
+    fill = [row for row in existing if row['mime'] is not None or row['extra'] is not None]
+    if fill:
+        objects.update((row.checksum, row)
+                       for row in db.db.session.execute(fill_objects(fill)))
+    unchanged = [row['checksum'] for row in existing if row['checksum'] not in objects]
+    if unchanged:
+        table = db.Object.__table__
+        objects.update((row.checksum, row) for row in db.db.session.execute(
+            sqlalchemy.select(table).where(table.c.checksum.in_(unchanged))))
+    results = []
+    new_files = {}
+    restart = set()  # taken over without resume, so the old multipart upload is dropped
+    for payload, checksum, error in zip(payloads, checksums, errors):
+        if error:
+            results.append(('error', None, error))
+            continue
+        my_obj = objects[checksum]
+        if my_obj.obj_size != payload['obj_size']:
+            # Same checksum yet another size, so not the same content
+            results.append(('conflict', my_obj, None))
+            continue
+        if checksum in claimed:
+            status = 'resume' if payload.get('resume') and my_obj.mpu_id else 'upload'
+            if status == 'upload' and my_obj.mpu_id:
+                restart.add(my_obj.uuid)
+            claimed.discard(checksum)
+        elif my_obj.completed and not my_obj.deleted:
+            status = 'exists'
+        else:
+            # Upload in progress under a live lease elsewhere, started earlier in this batch,
+            # or the object was intentionally deleted so we will not allow reupload
+            results.append(('conflict', my_obj, None))
+            continue
+        new_files.setdefault((payload['url'], my_obj.uuid), {
+            'uuid': uuid.uuid1(),
+            'obj_uuid': my_obj.uuid,
+            'ctime': datetime.datetime.utcnow(),
+            'mtime': payload.get('mtime'),
+            'url': payload['url'],
+            'direct': payload.get('direct', True),
+            'partial': payload.get('partial', False),
+            'extra': payload.get('extra_file'),
+            'ul_user': payload.get('ul_user'),
+            'ul_sw': payload.get('ul_sw'),
+            'ul_host': payload.get('ul_host')})
+        results.append((status, my_obj, payload))
+    files = {}
+    if new_files:
+        files = {(row.url, row.obj_uuid): row
+                 for row in db.db.session.execute(upsert_files([new_files[key]
+                                                                for key in sorted(new_files)]))}
+    for i, (status, my_obj, payload) in enumerate(results):
+        if status in ('conflict', 'error'):
+            continue
+        row = files[(payload['url'], my_obj.uuid)]
+        if (row.direct, row.partial) != (payload.get('direct', True), payload.get('partial', False)):
+            results[i] = ('error', None,
+                          f"File {payload['url']} is already indexed with other direct/partial flags")
+            continue
+        results[i] = (status, my_obj, row.uuid)
+    if restart:
+        # NOTE the S3 side is left to obj-idx-admin abort-multipart --orphans
+        db.Part.query.filter(db.Part.obj_uuid.in_(restart)).delete(synchronize_session=False)
+        db.Object.query.filter(db.Object.uuid.in_(restart)).update(
+            {'mpu_id': None, 'mpu_part_size': None, 'mpu_time': None},
+            synchronize_session=False)
+    db.db.session.commit()
+    invalidate({row.uuid for row in objects.values()})
+    # Load everything we will marshal in bulk rather than lazily one by one
+    file_uuids = {file_uuid for status, _, file_uuid in results
+                  if file_uuid and status != 'error'}
+    orm_files = {}
+    if file_uuids:
+        orm_files = {my_file.uuid: my_file for my_file in
+                     db.File.query.options(*file_load(fil)).filter(db.File.uuid.in_(file_uuids))}
+    orm_objects = {my_obj.uuid: my_obj for my_obj in
+                   db.Object.query.filter(db.Object.uuid.in_({row.uuid for row in objects.values()}))}
+    for status, _, _ in results:
+        UPLOADS.inc(status)
+    return [(status, None, file_uuid) if status == 'error' else
+            (status, orm_objects[my_obj.uuid], orm_files.get(file_uuid))
+            for status, my_obj, file_uuid in results]
+
+def upload_result(status, my_obj, my_file):
+    """Build the UploadResult for a registered upload"""
+    retobj = {'file': my_file, 'exists': status == 'exists'}
+    if status == 'exists':
+        retobj['download'] = get_dl_url(my_obj)
+    else:
+        # NOTE the s3 URL is not really a URL but a dictionary with access info
+        # NOTE the finished URL may be relative
+        retobj['upload'] = {'s3': get_dl_url(my_obj),
+                            'finished': api.url_for(ObjectOne, obj_uuid=my_obj.uuid)}
+        retobj['lease'] = {'id': my_obj.lease_id,
+                           'expires': my_obj.lease_expires,
+                           'ttl': lease_ttl()}
+    if status == 'resume':
+        retobj['multipart'] = my_obj
+    return retobj
+
+
 @uplns.route('/')
 class Upload(flask_restx.Resource):
     """Upload convenience API"""
 
     @uplns.doc('submit_upload')
+    @uplns.response(400, 'Upload payload refused, e.g. a bucket not indexed here')
     @uplns.expect(upl)
     @uplns.marshal_with(ulr, code=201)
     def post(self):
         """Upload or get info"""
-        exists = False
-        checksum = bytes.fromhex(api.payload['checksum'])
-        assert api.payload['bucket'] in app.config['OBJIDX_BUCKETS']
-        my_obj = db.Object.query.filter_by(checksum=checksum).one_or_none()
-        if my_obj:
-            exists = True
-            assert my_obj.obj_size == api.payload['obj_size']
-            if not my_obj.completed:
-                # Upload was initiated before but not finished
-                if not my_obj.deleted:
-                    # We believe it may still be in progress so will declare a conflict
-                    flask_restx.abort(409,
-                                      "Conflict: an upload of an object with the same checksum may currently be in progress",
-                                      object_uuid=str(my_obj.uuid))
-                # The failed upload has been cleared/deleted so now we will allow restart
-                my_obj.deleted = False
-                exists = False
-            assert not my_obj.deleted  # Object was intentionally deleted so we will not allow reupload
-            if api.payload['mime'] and not my_obj.mime:
-                my_obj.mime = api.payload['mime']
-            if api.payload.get('extra_object') and not my_obj.extra:
-                my_obj.extra = api.payload['extra_object']
-        else:
-            my_obj = db.Object(bucket=api.payload['bucket'],
-                               key=f"{checksum.hex()}-{sanitize_filename(api.payload['filename'])}",
-                               obj_size=api.payload['obj_size'],
-                               checksum=checksum,
-                               mime=api.payload.get('mime'),
-                               extra=api.payload.get('extra_object'))
-            db.db.session.add(my_obj)
-        my_file = db.File.query.filter_by(url=api.payload['url'], file_object=my_obj).one_or_none()
-        if my_file:
-            #assert exists
-            assert my_file.direct == api.payload['direct']
-            assert my_file.partial == api.payload['partial']
-            if api.payload['mtime'] and not my_file.mtime:
-                my_file.mtime = api.payload['mtime']
-            if api.payload.get('extra_file') and not my_file.extra:
-                my_file.extra = api.payload['extra_file']
-        else:
-            my_file = db.File(file_object=my_obj,
-                              mtime=api.payload['mtime'],
-                              url=api.payload['url'],
-                              direct=api.payload['direct'],
-                              partial=api.payload.get('partial'),
-                              extra=api.payload.get('extra_file'),
-                              ul_user=api.payload['ul_user'],
-                              ul_sw=api.payload['ul_sw'],
-                              ul_host=api.payload['ul_host'])
-            db.db.session.add(my_file)
+        ((status, my_obj, my_file), ) = register_uploads([api.payload])
+        if status == 'error':
+            flask_restx.abort(400, my_file)
+        if status == 'conflict':
+            flask_restx.abort(409,
+                              "Conflict: an upload of an object with the same checksum may currently be in progress",
+                              object_uuid=str(my_obj.uuid))
+        return upload_result(status, my_obj, my_file), 201
 
-        db.db.session.commit()
-        #print(my_file.__dict__)
-        retobj =  {'file': my_file, 'exists': exists}
-        #retobj['file']['object'] = my_obj
-        if exists:
-            retobj['download'] = get_dl_url(my_obj)
-        else:
-            # NOTE the s3 URL is not really a URL but a dictionary with access info
-            # NOTE the finished URL may be relative
-            retobj['upload'] = {'s3': get_dl_url(my_obj),
-                                'finished': api.url_for(ObjectOne, obj_uuid=my_obj.uuid)}
-        return retobj, 201
+
+@uplns.route('/batch')
+class UploadBatch(flask_restx.Resource):
+    """Upload convenience API for many files at once"""
+
+    @uplns.doc('submit_upload_batch')
+    @uplns.expect(ulb)
+    @uplns.marshal_list_with(ubr, code=201)
+    def post(self):
+        """Upload or get info for a list of files
+
+        Each result has a status; conflicts and errors do not fail the rest of the batch
+        """
+        results = []
+        for status, my_obj, my_file in register_uploads(api.payload['uploads']):
+            if status == 'error':
+                results.append({'status': status, 'message': my_file})
+                continue
+            if status == 'conflict':
+                results.append({'status': status, 'object_uuid': str(my_obj.uuid)})
+                continue
+            retobj = upload_result(status, my_obj, my_file)
+            retobj['status'] = status
+            retobj['object_uuid'] = str(my_obj.uuid)
+            results.append(retobj)
+        return results, 201
+
+
+@uplns.route('/staging')
+class UploadStaging(flask_restx.Resource):
+    """Scratch S3 location for uploading before the checksum is known"""
+
+    @uplns.doc('stage_upload')
+    @uplns.expect(stg)
+    @uplns.marshal_with(s3l, code=201)
+    def post(self):
+        """Get a staging key
+
+        The client streams the file here while hashing it, then submits the upload as
+        usual and copies the staged object to the final key server side
+        """
+        if api.payload.get('bucket') not in app.config['OBJIDX_BUCKETS']:
+            flask_restx.abort(400, "Bucket is not indexed here")
+        filename = sanitize_filename(api.payload.get('filename') or '')
+        return {'server': app.config['OBJIDX_S3'],
+                'bucket': api.payload['bucket'],
+                'key': f"{s3lib.STAGING_PREFIX}{uuid.uuid4().hex}-{filename}"}, 201
 
 
 @filns.route('/')
@@ -180,25 +707,29 @@ class FileList(flask_restx.Resource):
     @filns.doc('search_files',
                params={'url': {'description': 'Source URL to search for',
                                'type': 'string'},
-                       'extra': {'description': 'Tags in file extra JSON to look for',
-                                 'type': 'string'}})
-    @filns.marshal_list_with(fil)
+                       'extra': {'description': 'key=value tag in file extra JSON to look for; repeat to require several',
+                                 'type': 'string'},
+                       **PAGE_PARAMS,
+                       **PROJECTION_PARAMS})
+    @filns.response(200, 'Success; one JSON object per line with Accept: application/x-ndjson', [fil])
     def get(self):
         """Search for a file"""
-        parser = flask_restx.reqparse.RequestParser()
+        model = projection(fil)
+        parser = page_parser()
         parser.add_argument('url')
-        parser.add_argument('extra')
+        parser.add_argument('extra', action='append')
         args = parser.parse_args()
         assert not (args.url and args.extra)
+        keys = CTIME_KEYS
+        query = db.File.query.options(*file_load(model))
         if args.extra:
-            parts = args.extra.partition('=')
-            assert parts[1] == '='
-            # TODO fix this - currently comes up with 0 results
-            return db.File.query.filter(db.File.extra[parts[0]].astext == parts[2]).all()
-        if args.url.endswith('*'):
-            # TODO escape %20 etc
-            return db.File.query.filter(db.File.url.like(f"{args.url[:-1]}%")).all()
-        return db.File.query.filter_by(url=args.url).all()
+            query = query.filter(extra_filter(db.File.extra, args.extra))
+        elif args.url.endswith('*'):
+            query = query.filter(db.File.url.collate('C').like(like_prefix(args.url[:-1])))
+            keys = URL_KEYS
+        else:
+            query = query.filter_by(url=args.url)
+        return list_response(query, db.File, args, model, keys)
 
 
 @filns.route('/<fil_uuid>/')
@@ -207,11 +738,16 @@ class FileList(flask_restx.Resource):
 class FileOne(flask_restx.Resource):
     """File instance"""
 
-    @filns.doc('get_file')
-    @filns.marshal_with(fil)
+    @filns.doc('get_file', params=PROJECTION_PARAMS)
+    @filns.response(200, 'Success', fil)
+    @filns.response(304, 'Not modified')
     def get(self, fil_uuid):
         """Get library media"""
-        return db.File.query.get_or_404(uuid.UUID(fil_uuid))
+        def load():
+            model = projection(fil)
+            my_file = db.File.query.options(*file_load(model)).get_or_404(uuid.UUID(fil_uuid))
+            return flask_restx.marshal(my_file, model), my_file.obj_uuid, None, None
+        return cached_response(projection_key('file', uuid.UUID(fil_uuid)), load)
 
 
 @objns.route('/')
@@ -220,15 +756,20 @@ class ObjectList(flask_restx.Resource):
 
     @objns.doc('search_objects',
                params={'checksum': {'description': 'Checksum to search for',
-                                    'type': 'string'}})
-    @objns.marshal_list_with(obj)
+                                    'type': 'string'},
+                       **PAGE_PARAMS,
+                       **PROJECTION_PARAMS})
+    @objns.response(200, 'Success; one JSON object per line with Accept: application/x-ndjson', [obj])
     def get(self):
         """Search for a file"""
-        parser = flask_restx.reqparse.RequestParser()
+        model = projection(obj)
+        parser = page_parser()
         parser.add_argument('checksum')
         args = parser.parse_args()
         checksum = bytes.fromhex(args['checksum'])
-        return db.Object.query.filter_by(checksum=checksum).all()
+        return list_response(db.Object.query.options(*object_load(model))
+                                            .filter_by(checksum=checksum),
+                             db.Object, args, model)
 
 
 @objns.route('/<obj_uuid>/')
@@ -237,20 +778,28 @@ class ObjectList(flask_restx.Resource):
 class ObjectOne(flask_restx.Resource):
     """Object instance"""
 
-    @objns.doc('get_object')
-    @objns.marshal_with(obj)
+    @objns.doc('get_object', params=PROJECTION_PARAMS)
+    @objns.response(200, 'Success', obj)
+    @objns.response(304, 'Not modified')
     def get(self, obj_uuid):
         """Get library media"""
-        return db.Object.query.get_or_404(uuid.UUID(obj_uuid))
+        def load():
+            model = projection(obj)
+            myobj = db.Object.query.options(*object_load(model)).get_or_404(uuid.UUID(obj_uuid))
+            return flask_restx.marshal(myobj, model), myobj.uuid, None, None
+        return cached_response(projection_key('object', uuid.UUID(obj_uuid)), load)
 
     @objns.doc('put_object')
+    @objns.response(409, 'Object was deleted, e.g. swept after its lease expired')
     @objns.marshal_with(obj)
     @objns.expect(obj)
     def put(self, obj_uuid):
         """Let us know an upload is completed"""
-        myobj = db.Object.query.get_or_404(uuid.UUID(obj_uuid))
+        myobj = db.Object.query.options(*object_load(obj)).get_or_404(uuid.UUID(obj_uuid))
         new_completed = api.payload.get('completed')
         new_deleted = api.payload.get('deleted')
+        if new_completed and myobj.deleted:
+            flask_restx.abort(409, "Conflict: object was deleted before the upload finished")
         if not myobj.completed and not myobj.deleted:
             assert not (new_completed and new_deleted)
             if new_completed or new_deleted:
@@ -258,9 +807,185 @@ class ObjectOne(flask_restx.Resource):
                     myobj.completed = True
                 if new_deleted:
                     myobj.deleted = True
+                clear_multipart(myobj)
                 db.db.session.commit()
+                invalidate({myobj.uuid})
+        return myobj
+
+def clear_multipart(myobj):
+    """Forget an object's multipart upload; the caller has completed or aborted it"""
+    myobj.mpu_id = None
+    myobj.mpu_part_size = None
+    myobj.mpu_time = None
+    db.Part.query.filter_by(obj_uuid=myobj.uuid).delete()
+
+def multipart_object(obj_uuid):
+    """Object whose upload is still in progress, else abort 404/409"""
+    myobj = db.Object.query.get_or_404(uuid.UUID(obj_uuid))
+    if myobj.completed or myobj.deleted:
+        flask_restx.abort(409, "Conflict: object is no longer being uploaded")
+    return myobj
+
+
+@objns.route('/<obj_uuid>/lease')
+@objns.response(404, 'Object not found')
+@objns.response(409, 'Lease lost: expired and taken over, or upload already over')
+@objns.param('obj_uuid', 'Object UUID')
+class ObjectLease(flask_restx.Resource):
+    """Lease on an object's upload, held by whoever was told to upload it"""
+
+    @objns.doc('renew_lease')
+    @objns.expect(lse)
+    @objns.marshal_with(lse)
+    def put(self, obj_uuid):
+        """Renew the upload lease; uploaders do this well within its ttl"""
+        table = db.Object.__table__
+        expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=lease_ttl())
+        renewed = db.db.session.execute(
+            table.update()
+            .where(table.c.uuid == uuid.UUID(obj_uuid))
+            .where(table.c.lease_id == uuid.UUID(api.payload['id']))
+            .where(~table.c.completed & ~table.c.deleted)
+            .values(lease_expires=expires)).rowcount
+        db.db.session.commit()
+        if not renewed:
+            db.Object.query.get_or_404(uuid.UUID(obj_uuid))
+            flask_restx.abort(409, "Conflict: lease lost")
+        return {'id': api.payload['id'], 'expires': expires, 'ttl': lease_ttl()}
+
+    @objns.doc('release_lease', params={'id': {'description': 'Lease ID', 'type': 'string'}})
+    @objns.marshal_with(lse)
+    def delete(self, obj_uuid):
+        """Give the upload lease up, e.g. after a failed transfer
+
+        It expires at once, so the next upload of the object takes it over rather
+        than getting a conflict until the ttl runs out
+        """
+        parser = flask_restx.reqparse.RequestParser()
+        parser.add_argument('id', required=True)
+        lease_id = parser.parse_args()['id']
+        table = db.Object.__table__
+        expires = datetime.datetime.utcnow()
+        released = db.db.session.execute(
+            table.update()
+            .where(table.c.uuid == uuid.UUID(obj_uuid))
+            .where(table.c.lease_id == uuid.UUID(lease_id))
+            .where(~table.c.completed & ~table.c.deleted)
+            .values(lease_expires=expires)).rowcount
+        db.db.session.commit()
+        if not released:
+            db.Object.query.get_or_404(uuid.UUID(obj_uuid))
+            flask_restx.abort(409, "Conflict: lease lost")
+        return {'id': lease_id, 'expires': expires, 'ttl': lease_ttl()}
+
+
+@objns.route('/<obj_uuid>/multipart')
+@objns.response(404, 'Object not found')
+@objns.response(409, 'Object not being uploaded, or another multipart upload is')
+@objns.param('obj_uuid', 'Object UUID')
+class ObjectMultipart(flask_restx.Resource):
+    """S3 multipart upload of an object, tracked so it can be resumed"""
+
+    @objns.doc('get_multipart')
+    @objns.marshal_with(mpu)
+    def get(self, obj_uuid):
+        """Get the multipart upload ID and the parts done so far"""
+        myobj = multipart_object(obj_uuid)
+        if not myobj.mpu_id:
+            flask_restx.abort(404, "No multipart upload recorded")
         return myobj
 
+    @objns.doc('start_multipart')
+    @objns.expect(mpu)
+    @objns.marshal_with(mpu)
+    def put(self, obj_uuid):
+        """Record the S3 multipart upload ID for an object being uploaded"""
+        myobj = multipart_object(obj_uuid)
+        table = db.Object.__table__
+        # NOTE conditional UPDATE so two uploaders can not both record their own
+        started = db.db.session.execute(
+            table.update()
+            .where(table.c.uuid == myobj.uuid)
+            .where(sqlalchemy.or_(table.c.mpu_id.is_(None),
+                                  table.c.mpu_id == api.payload['upload_id']))
+            .values(mpu_id=api.payload['upload_id'],
+                    mpu_part_size=api.payload['part_size'],
+                    mpu_time=datetime.datetime.utcnow())).rowcount
+        db.db.session.commit()
+        if not started:
+            flask_restx.abort(409, "Conflict: another multipart upload is recorded",
+                              upload_id=myobj.mpu_id)
+        return myobj
+
+    @objns.doc('clear_multipart')
+    @objns.response(204, 'Cleared')
+    def delete(self, obj_uuid):
+        """Forget the multipart upload, e.g. after aborting it in S3"""
+        myobj = multipart_object(obj_uuid)
+        clear_multipart(myobj)
+        db.db.session.commit()
+        return '', 204
+
+
+@objns.route('/<obj_uuid>/multipart/<int:number>')
+@objns.response(404, 'Object not found')
+@objns.response(409, 'Object not being uploaded, or under another multipart upload')
+@objns.param('obj_uuid', 'Object UUID')
+@objns.param('number', 'Part number')
+class ObjectPart(flask_restx.Resource):
+    """A part of an object's multipart upload"""
+
+    @objns.doc('put_part')
+    @objns.expect(mpp)
+    @objns.marshal_with(mpp)
+    def put(self, obj_uuid, number):
+        """Record an uploaded part; upload_id must match the recorded one"""
+        myobj = multipart_object(obj_uuid)
+        if not myobj.mpu_id or myobj.mpu_id != api.payload.get('upload_id'):
+            flask_restx.abort(409, "Conflict: not the recorded multipart upload")
+        table = db.Part.__table__
+        insert = pg_insert(table).values(obj_uuid=myobj.uuid,
+                                         number=number,
+                                         etag=api.payload['etag'],
+                                         size=api.payload['size'])
+        db.db.session.execute(insert.on_conflict_do_update(
+            index_elements=[table.c.obj_uuid, table.c.number],
+            set_={'etag': insert.excluded.etag, 'size': insert.excluded.size}))
+        myobj.mpu_time = datetime.datetime.utcnow()
+        db.db.session.commit()
+        return {'number': number, 'etag': api.payload['etag'], 'size': api.payload['size']}
+
+
+@objns.route('/presigned')
+class ObjectPresigned(flask_restx.Resource):
+    """Presigned download URLs for many objects at once"""
+
+    @objns.doc('presign_objects')
+    @objns.response(400, f'More than {MAX_PRESIGN} objects, or not UUIDs')
+    @objns.expect(psr)
+    @objns.marshal_list_with(psu)
+    def post(self):
+        """Get presigned HTTP URLs for a list of object UUIDs
+
+        All objects are read in one query and signed locally with the shared client;
+        unknown UUIDs come back without a URL
+        """
+        if len(api.payload['objects']) > MAX_PRESIGN:
+            flask_restx.abort(400, f"at most {MAX_PRESIGN} objects")
+        try:
+            obj_uuids = [uuid.UUID(obj_uuid) for obj_uuid in api.payload['objects']]
+        except (TypeError, ValueError):
+            flask_restx.abort(400, "objects must be UUIDs")
+        expires = api.payload.get('expires') or PRESIGN_EXPIRES
+        s3_obj = get_s3_obj()
+        objects = {my_obj.uuid: my_obj
+                   for my_obj in db.Object.query.filter(db.Object.uuid.in_(set(obj_uuids)))}
+        return [{'uuid': str(obj_uuid),
+                 'presigned': (presigned(s3_obj, objects[obj_uuid], expires)
+                               if obj_uuid in objects else None)}
+                for obj_uuid in obj_uuids]
+
+
 @objns.route('/<obj_uuid>/download')
 @objns.response(404, 'Object not found')
 @objns.param('obj_uuid', 'Object UUID')
@@ -270,13 +995,24 @@ class ObjectDownload(flask_restx.Resource):
     @objns.doc('download_object',
                params={'presigned': {'description': 'Presigned HTTP URL instead of plain S3',
                                      'type': 'boolean'}})
-    @objns.marshal_with(s3l)
+    @objns.response(200, 'Success', s3l)
+    @objns.response(304, 'Not modified')
     def get(self, obj_uuid):
-        """Get S3 download info for object"""
+        """Get S3 download info for object
+
+        Bucket and key of a completed object never change, so that answer is immutable
+        """
         parser = flask_restx.reqparse.RequestParser()
         parser.add_argument('presigned')
         args = parser.parse_args()
-        db_obj = db.Object.query.get_or_404(uuid.UUID(obj_uuid))
         if args.presigned:
-            return {'presigned': s3lib.presigned(get_s3_obj(), db_obj.bucket, db_obj.key)}
-        return get_dl_url(db_obj)
+            db_obj = db.Object.query.get_or_404(uuid.UUID(obj_uuid))
+            return flask_restx.marshal(
+                {'presigned': presigned(get_s3_obj(), db_obj)}, s3l)
+        def load():
+            db_obj = db.Object.query.get_or_404(uuid.UUID(obj_uuid))
+            cache_control, last_modified = None, None
+            if db_obj.completed and not db_obj.deleted:
+                cache_control, last_modified = IMMUTABLE, db_obj.ctime
+            return flask_restx.marshal(get_dl_url(db_obj), s3l), db_obj.uuid, cache_control, last_modified
+        return cached_response(('download', uuid.UUID(obj_uuid)), load)
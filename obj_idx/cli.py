@@ -3,21 +3,175 @@
 """CLI for object index client"""
 
 import argparse
+import asyncio
+import json
 import os
-from . import client
+import sys
+import warnings
+from . import client, clilib, fetch, hashcache, s3lib, watch
+
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_size(size: str) -> int:
+    """Parse a byte count like 8388608, 8M or 1G"""
+    if size[-1:].upper() in SIZE_SUFFIXES:
+        return int(float(size[:-1]) * SIZE_SUFFIXES[size[-1:].upper()])
+    return int(size)
+
+def add_transfer_args(parser):
+    """Add S3 managed transfer options to an argparse parser
+
+    Defaults come from OBJIDX_MULTIPART_THRESHOLD, OBJIDX_MULTIPART_CHUNKSIZE and
+    OBJIDX_MAX_CONCURRENCY
+    """
+    parser.add_argument('--multipart-threshold', type=parse_size,
+                        default=os.environ.get('OBJIDX_MULTIPART_THRESHOLD'))
+    parser.add_argument('--multipart-chunksize', type=parse_size,
+                        default=os.environ.get('OBJIDX_MULTIPART_CHUNKSIZE'))
+    parser.add_argument('--max-concurrency', type=int,
+                        default=os.environ.get('OBJIDX_MAX_CONCURRENCY'),
+                        help="threads per S3 transfer")
+
+def configure_transfer(args):
+    """Apply add_transfer_args options to s3lib"""
+    s3lib.configure_transfer(multipart_threshold=args.multipart_threshold,
+                             multipart_chunksize=args.multipart_chunksize,
+                             max_concurrency=args.max_concurrency)
+
+def add_pipeline_args(parser):
+    """Add upload pipeline concurrency options to an argparse parser"""
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="concurrent registrations and S3 transfers")
+    parser.add_argument('--hash-workers', type=int, default=1,
+                        help="concurrent checksum readers")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="do not use the local checksum cache")
+    parser.add_argument('--batch', type=int, default=0,
+                        help="register up to this many files per API request")
+    parser.add_argument('--single-read', action='store_true',
+                        help="hash while uploading to a staging key, reading each file once")
+    parser.add_argument('--stats', action='store_true',
+                        help="print per phase timings and throughput to stderr at the end")
+    parser.add_argument('--stats-json', metavar='FILE',
+                        help="write the same as JSON to FILE, - for stdout")
+    add_transfer_args(parser)
+
+def run_pipeline(obj_idx, jobs, args) -> int:
+    """Run UploadJobs through the client pipeline per CLI options
+
+    Prints each job that made it into the index; conflicts and errors are warned
+    about. Returns how many there were of those, so callers can exit non-zero
+    """
+    configure_transfer(args)
+    obj_idx.mount(max(clilib.POOL_SIZE, args.jobs + args.hash_workers))
+    cache = None if args.no_cache else hashcache.ChecksumCache()
+    stats = client.Stats() if args.stats or args.stats_json else None
+    failed = 0
+    try:
+        for job in client.upload_jobs(obj_idx, jobs,
+                                      hash_workers=args.hash_workers,
+                                      transfer_workers=args.jobs,
+                                      cache=cache,
+                                      single_read=args.single_read,
+                                      register_batch=args.batch):
+            if stats:
+                stats.add(job)
+            if job.conflict:
+                warnings.warn(f"Conflict for file {job.filename}; existing object {job.conflict}")
+                failed += 1
+                continue
+            if job.error:
+                warnings.warn(f"Upload of {job.filename} failed: {job.error!r}")
+                failed += 1
+                continue
+            # TODO state whether it is a new upload?
+            print(job.filename, job.file.uuid, flush=True)
+    finally:
+        # NOTE also when interrupted, e.g. watch stopped with ^C
+        if stats:
+            report_stats(stats, args)
+    return failed
+
+def report_stats(stats, args):
+    """Print or write a client.Stats summary per --stats and --stats-json"""
+    if args.stats:
+        print(stats.report(), file=sys.stderr)
+    if args.stats_json == '-':
+        print(json.dumps(stats.summary()))
+    elif args.stats_json:
+        with open(args.stats_json, 'w', encoding='utf-8') as stats_file:
+            json.dump(stats.summary(), stats_file, indent=1)
 
 def _upload(obj_idx, args):
     tags = {x.partition('=')[0]: x.partition('=')[2] for x in args.tag}
-    for filename in args.filename:
-        fileobj = client.upload(filename, obj_idx, args.bucket, tags)
-        # TODO state whether it is a new upload?
-        print(filename, fileobj.uuid)
+    jobs = (client.UploadJob(filename, args.bucket, extra=tags) for filename in args.filename)
+    if run_pipeline(obj_idx, jobs, args):
+        sys.exit(1)
+
+def _sync(obj_idx, args):
+    tags = {x.partition('=')[0]: x.partition('=')[2] for x in args.tag}
+    counts = {}
+    failed = run_pipeline(obj_idx, client.sync_jobs(obj_idx, args.directory, args.bucket,
+                                                    tags, counts), args)
+    uploaded = counts['scanned'] - counts['skipped'] - failed
+    print(f"{counts['scanned']} files, {counts['skipped']} unchanged, {uploaded} uploaded, "
+          f"{failed} failed", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+def _watch(obj_idx, args):
+    if args.info_json:
+        make_job = watch.ytdl_jobs(args.bucket, args.partial, args.library)
+    else:
+        make_job = watch.plain_jobs(args.bucket,
+                                    {x.partition('=')[0]: x.partition('=')[2] for x in args.tag})
+    jobs = watch.watch_jobs(args.directory, make_job, args.settle, args.existing)
+    if run_pipeline(obj_idx, jobs, args):
+        sys.exit(1)
 
 def _download(obj_idx, args):
+    done = {}
+    skipped = 0
     for url in args.url:
-        files = client.download(obj_idx, url, args.pretend)
+        files = list(obj_idx.search_files({'url': url}))
+        if not args.pretend:
+            client.download_files(files, args.output_dir, args.jobs, done, args.chunk_size)
         for file in files:
-            print(url, file.info['url'], file.uuid, file.get_s3_url())
+            if file.object and (args.pretend or file.object['uuid'] in done):
+                print(url, file.info['url'], file.uuid,
+                      done.get(file.object['uuid']) or file.get_s3_url())
+                continue
+            if args.pretend:
+                warnings.warn(f"No object for {file.info['url']} ({file.uuid})")
+            skipped += 1  # otherwise download_files warned about it
+    if skipped:
+        sys.exit(1)
+
+def _lookup(_, args):
+    # NOTE imported here as aiohttp is an optional dependency
+    from . import aclient  # pylint: disable=import-outside-toplevel
+    urls = args.url
+    if urls == ['-']:
+        urls = [line.strip() for line in sys.stdin if line.strip()]
+    async def run():
+        async with aclient.get_obj_idx(os.environ['OBJIDX_URL'],
+                                       os.environ['OBJIDX_AUTH'].partition(':')[0],
+                                       args.concurrency) as obj_idx:
+            async for url, files in aclient.search_many(obj_idx, urls):
+                if not files:
+                    print(url, '-')
+                for file in files:
+                    print(url, file.uuid)
+    asyncio.run(run())
+
+def _cache(_, args):
+    cache = hashcache.ChecksumCache()
+    if args.clear:
+        cache.clear()
+        print("cleared", cache.path)
+        return
+    max_age = args.max_age * 86400 if args.max_age is not None else None
+    print("pruned", cache.prune(max_age), "entries from", cache.path)
 
 def cli():
     """CLI main function"""
@@ -26,12 +180,49 @@ def cli():
     parser_upload = subparsers.add_parser('upload')
     parser_upload.add_argument('-b', '--bucket')
     parser_upload.add_argument('-t', '--tag', action='append', default=[])
+    add_pipeline_args(parser_upload)
     parser_upload.add_argument('filename', nargs='+')
     parser_upload.set_defaults(func=_upload)
+    parser_sync = subparsers.add_parser('sync',
+                                        help="upload the files in a tree that are new or changed")
+    parser_sync.add_argument('-b', '--bucket')
+    parser_sync.add_argument('-t', '--tag', action='append', default=[])
+    add_pipeline_args(parser_sync)
+    parser_sync.add_argument('directory')
+    parser_sync.set_defaults(func=_sync)
+    parser_watch = subparsers.add_parser('watch',
+                                         help="upload files as they land in a tree (Linux)")
+    parser_watch.add_argument('-b', '--bucket')
+    parser_watch.add_argument('-t', '--tag', action='append', default=[])
+    parser_watch.add_argument('--settle', type=float, default=watch.SETTLE,
+                              help="seconds a file must be left alone before upload")
+    parser_watch.add_argument('--existing', action='store_true',
+                              help="also upload files already there")
+    parser_watch.add_argument('--info-json', action='store_true',
+                              help="yt-dlp output: upload media with their .info.json metadata")
+    parser_watch.add_argument('-P', '--partial', action='store_true')
+    parser_watch.add_argument('-l', '--library')
+    add_pipeline_args(parser_watch)
+    parser_watch.add_argument('directory')
+    parser_watch.set_defaults(func=_watch)
     parser_download = subparsers.add_parser('download')
     parser_download.add_argument('-p', '--pretend', action='store_true')
+    parser_download.add_argument('-j', '--jobs', type=int, default=4,
+                                 help="parallel range requests per object")
+    parser_download.add_argument('-o', '--output-dir', default='.')
+    parser_download.add_argument('--chunk-size', type=parse_size, default=fetch.CHUNK_SIZE,
+                                 help="bytes per range request")
     parser_download.add_argument('url', nargs='+')
     parser_download.set_defaults(func=_download)
+    parser_lookup = subparsers.add_parser('lookup',
+                                          help="check many source URLs concurrently (needs aiohttp)")
+    parser_lookup.add_argument('-c', '--concurrency', type=int, default=32)
+    parser_lookup.add_argument('url', nargs='+', help="URLs to look up, or - to read from stdin")
+    parser_lookup.set_defaults(func=_lookup)
+    parser_cache = subparsers.add_parser('cache', help="prune and compact the checksum cache")
+    parser_cache.add_argument('--max-age', type=float, help="also drop entries older than DAYS")
+    parser_cache.add_argument('--clear', action='store_true')
+    parser_cache.set_defaults(func=_cache)
     oi_url = os.environ['OBJIDX_URL']
     oi_user = os.environ['OBJIDX_AUTH'].partition(':')[0]
     args = parser.parse_args()
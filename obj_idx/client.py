@@ -3,19 +3,40 @@
 Currently it relies on ObjectIndex for all info it needs on S3, other than bucket name
 """
 
+import collections
+import contextlib
+import math
+import os
 import socket
 import pathlib
 import hashlib
+import json
 import mimetypes
 import datetime
 import warnings
-from . import s3lib, clilib
+import threading
+import time
+import queue
+from . import s3lib, clilib, hashcache, fetch, multipart
 
 SW_STRING = 'OIC-0.1'
 BLOCK_SIZE = 16777216
+QUEUE_SIZE = 16
+SYNC_FIELDS = ['url', 'mtime', 'file_object.obj_size', 'file_object.completed']
 
-def checksum(file_path: pathlib.Path) -> bytes:
-    """Get SHA256 checksum of a given path"""
+def checksum(file_path: pathlib.Path,
+             cache: hashcache.ChecksumCache = None,
+             file_stat=None) -> bytes:
+    """Get SHA256 checksum of a given path
+
+    If a cache is given it is consulted first and updated after reading the file
+    """
+    if cache:
+        if not file_stat:
+            file_stat = pathlib.Path(file_path).stat()
+        cached = cache.get(file_stat)
+        if cached:
+            return cached
     check = hashlib.sha256()
     with open(file_path, "rb") as file_obj:
         while True:
@@ -23,6 +44,8 @@ def checksum(file_path: pathlib.Path) -> bytes:
             if len(data) == 0:
                 break
             check.update(data)
+    if cache:
+        cache.put(file_path, file_stat, check.digest())
     return check.digest()
 
 def get_mime(file_path: pathlib.Path) -> str:
@@ -30,71 +53,150 @@ def get_mime(file_path: pathlib.Path) -> str:
     # TODO add magic from mediacrawler
     return mimetypes.guess_type(file_path)[0]
 
-def upload(filename: str, obj_idx: clilib.ObjectIndex, bucket: str, tags: dict) -> clilib.File:
-    """Run an actual file upload into ObjIdx and S3"""
-    # TODO consider refactoring information gathering with mediacrawler fs.File.get_media()
-    file_path = pathlib.Path(filename)
-    file_stat = file_path.stat()
-    file_checksum = checksum(file_path)
-    file_mime = get_mime(file_path)
+class _HashingReader:
+    """Read-only, non-seekable file wrapper hashing everything read through it
+
+    Being non-seekable makes boto3 read it strictly in order, even for multipart
+    """
+    def __init__(self, file_obj):
+        self.file_obj = file_obj
+        self.check = hashlib.sha256()
+        self.size = 0
+    def read(self, size=-1):
+        """Read and hash"""
+        data = self.file_obj.read(size)
+        self.check.update(data)
+        self.size += len(data)
+        return data
 
+def file_url(file_path: pathlib.Path) -> str:
+    """Get file://host/path URL for a local path"""
     # TODO consider using file_path.resolve() instead?
     file_base_uri = str(file_path.absolute().as_uri())
-    file_uri = f"{file_base_uri[:7]}{socket.gethostname()}{file_base_uri[7:]}"
-    my_file = obj_idx.initiate_upload(url=file_uri,
-                                      bucket=bucket,
-                                      obj_size=file_stat.st_size,
-                                      # TODO timezone
-                                      mtime=datetime.datetime.fromtimestamp(file_stat.st_mtime),
-                                      filename=file_path.name,
-                                      extra_file=tags,
-                                      checksum=file_checksum,
-                                      mime=file_mime)
-    if not my_file.exists():
-        s3_url = my_file.get_s3_url()
-        bucket = s3lib.get_s3_service_url(s3_url['server']).Bucket(s3_url['bucket'])
-        # TODO send checksum; see https://github.com/boto/boto3/issues/3604
-        bucket.upload_file(filename, s3_url['key'])
-        my_file.finish_upload()
-    return my_file
+    return f"{file_base_uri[:7]}{socket.gethostname()}{file_base_uri[7:]}"
 
-def get_obj_idx(url, user):
-    """Get ObjectIndex object"""
-    # TODO add in user and auth
-    return clilib.ObjectIndex(url, host=socket.gethostname(), sw=SW_STRING, user=user)
 
-def download(obj_idx: clilib.ObjectIndex, url: str, pretend: bool = False) -> list[clilib.File]:
-    """Download a file with given original URL"""
-    files = obj_idx.search_files({'url': url})
-    if pretend:
-        return files
-    for file in files:
-        s3_url = file.get_s3_url()
-        bucket = s3lib.get_s3_service_url(s3_url['server']).Bucket(s3_url['bucket'])
-        # TODO allow selecting target
-        bucket.download_file(s3_url['key'], s3_url['key'])
-    # TODO verify
-    return files
+class UploadJob:
+    """A single file making its way through hash, register and transfer"""
+    def __init__(self, filename: str, bucket: str,
+                 url: str = None,
+                 mtime: datetime.datetime = None,
+                 direct: bool = True,
+                 partial: bool = False,
+                 extra: dict = None):
+        self.filename = filename
+        self.path = pathlib.Path(filename)
+        self.bucket = bucket
+        self.url = url if url else file_url(self.path)
+        self.mtime = mtime
+        self.direct = direct
+        self.partial = partial
+        self.extra = extra
+        self.stat = None
+        self.checksum = None
+        self.mime = None
+        self.staged = None
+        self.file = None
+        self.conflict = None
+        self.error = None
+        self.keeper = None
+        self.seconds = {}  # per phase: hash or stage, register, transfer or copy, finish
+        self.bytes = {}
 
-def upload_metadata(filename: str,
-                    obj_idx: clilib.ObjectIndex,
-                    bucket: str,
-                    url: str,
-                    mtime: datetime.datetime = None,
-                    direct: bool = True,
-                    partial: bool = False,
-                    library: str = None,
-                    person: str = None,
-                    media: str = None,
-                    ytdl_info: dict = None,
-                    extra: dict = None) -> clilib.File:
-    """Upload file with metadata"""
-    # TODO refactor with upload() and future upload stream/new
-    file_path = pathlib.Path(filename)
-    file_stat = file_path.stat()
-    file_checksum = checksum(file_path)
-    file_mime = get_mime(file_path)
+    def __repr__(self):
+        return f"UploadJob({self.filename!r})"
+
+
+@contextlib.contextmanager
+def phase(job: UploadJob, name: str, nbytes: int = 0):
+    """Add the time the with block takes, and nbytes if it succeeds, to a job's phase"""
+    start = time.perf_counter()
+    try:
+        yield
+        job.bytes[name] = job.bytes.get(name, 0) + nbytes
+    finally:
+        job.seconds[name] = job.seconds.get(name, 0) + time.perf_counter() - start
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest rank percentile of a sorted list"""
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+class Stats:
+    """Per phase timings and byte counts of finished UploadJobs, for --stats"""
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.outcomes = collections.Counter()
+        self.seconds = collections.defaultdict(list)
+        self.bytes = collections.Counter()
 
+    def add(self, job: UploadJob):
+        """Count a job that came out of the pipeline"""
+        if job.error:
+            self.outcomes['error'] += 1
+        elif job.conflict:
+            self.outcomes['conflict'] += 1
+        elif job.file and job.file.exists():
+            self.outcomes['exists'] += 1
+        else:
+            self.outcomes['uploaded'] += 1
+        for name, seconds in job.seconds.items():
+            self.seconds[name].append(seconds)
+            self.bytes[name] += job.bytes.get(name, 0)
+
+    def summary(self) -> dict:
+        """Everything as a JSON friendly dict
+
+        Per phase MB/s is bytes over the time spent in that phase, i.e. per worker;
+        the overall figure is bytes sent over wall clock time
+        """
+        elapsed = time.perf_counter() - self.start
+        phases = {}
+        for name, seconds in self.seconds.items():
+            seconds = sorted(seconds)
+            total = sum(seconds)
+            phases[name] = {'count': len(seconds),
+                            'seconds': total,
+                            'max': seconds[-1],
+                            'bytes': self.bytes[name],
+                            'mb_per_s': self.bytes[name] / total / 1e6 if total else None}
+            phases[name].update((f"p{pct}", percentile(seconds, pct)) for pct in self.PERCENTILES)
+        sent = self.bytes['transfer'] + self.bytes['stage']
+        return {'files': sum(self.outcomes.values()),
+                'outcomes': dict(self.outcomes),
+                'elapsed': elapsed,
+                'mb_per_s': sent / elapsed / 1e6 if elapsed else None,
+                'phases': phases}
+
+    def report(self) -> str:
+        """Summary as a small text table"""
+        summary = self.summary()
+        lines = [f"{summary['files']} files in {summary['elapsed']:.1f}s "
+                 f"({summary['mb_per_s'] or 0:.1f} MB/s sent) {summary['outcomes']}",
+                 f"{'phase':10}{'count':>7}{'total s':>10}" +
+                 ''.join(f"{f'p{pct} s':>9}" for pct in self.PERCENTILES) +
+                 f"{'max s':>9}{'MB':>10}{'MB/s':>8}"]
+        for name, info in summary['phases'].items():
+            mb_per_s = f"{info['mb_per_s']:.1f}" if info['bytes'] else '-'
+            lines.append(f"{name:10}{info['count']:>7}{info['seconds']:>10.2f}" +
+                         ''.join(f"{info[f'p{pct}']:>9.3f}" for pct in self.PERCENTILES) +
+                         f"{info['max']:>9.3f}{info['bytes'] / 1e6:>10.1f}{mb_per_s:>8}")
+        return '\n'.join(lines)
+
+
+def metadata_job(filename: str,
+                 bucket: str,
+                 url: str,
+                 mtime: datetime.datetime = None,
+                 direct: bool = True,
+                 partial: bool = False,
+                 library: str = None,
+                 person: str = None,
+                 media: str = None,
+                 ytdl_info: dict = None,
+                 extra: dict = None) -> UploadJob:
+    """Build an UploadJob with LPM and ytdl metadata"""
     if not extra:
         extra = {}
     if library:
@@ -117,31 +219,535 @@ def upload_metadata(filename: str,
             mtime = datetime.datetime.fromtimestamp(ytdl_info['timestamp'])
     else:
         extra['ytdl-info'] = None
+    return UploadJob(filename, bucket, url=url, mtime=mtime, direct=direct,
+                     partial=partial, extra=extra)
+
+def read_info_json(filename: str) -> dict:
+    """Return data from a yt-dlp .info.json file"""
+    with open(filename, encoding="utf-8") as user_file:
+        return json.load(user_file)
+
+def info_json_media(info_json: str) -> tuple:
+    """(metadata, media file name) for a yt-dlp .info.json sidecar
+
+    (None, None) with a warning for playlists, which have no media file
+    """
+    metadata = read_info_json(info_json)
+    if metadata.get('_type') == 'playlist':
+        warnings.warn(f"Skipping playlist {info_json}")
+        return None, None
+    extension = metadata.get('ext')
+    assert extension
+    base_file_name = info_json.removesuffix('.info.json')
+    assert base_file_name != info_json
+    return metadata, base_file_name + "." + extension
+
+def ytdl_metadata(metadata: dict, partial: bool = False, library: str = None) -> tuple:
+    """Source URL, person and media name for yt-dlp metadata
+
+    Person and media are only worked out for a library, i.e. if uploader is a person
+    """
+    url = metadata.get('webpage_url')
+    if not (url and url.startswith('http')):
+        url = metadata.get('url')
+    assert url.startswith('http')
+    person = None
+    media = None
+    if library:
+        person = metadata.get('uploader')
+        if metadata.get('creator'):
+            person = metadata.get('creator')
+        if partial:
+            assert person
+            starttime = datetime.datetime.utcfromtimestamp(metadata['timestamp']).isoformat()
+            media = f'live-{person}-{starttime}-{metadata.get("id")}'
+        else:
+            if person:
+                media = f'vid-{person}-{metadata.get("id")}'
+            else:
+                media = metadata.get("id")
+    return url, person, media
+
+def ytdl_job(metadata: dict, filename: str, bucket: str,
+             partial: bool = False, library: str = None) -> UploadJob:
+    """Build an UploadJob for a file downloaded by yt-dlp, from its JSON metadata
+
+    Partial should be specified for live or whenever a URL is not fully captured
+    """
+    url, person, media = ytdl_metadata(metadata, partial, library)
+    return metadata_job(filename,
+                        bucket=bucket,
+                        url=url,
+                        direct=False,
+                        partial=partial,
+                        ytdl_info=metadata,
+                        library=library,
+                        person=person,
+                        media=media)
+
+def hash_job(job: UploadJob, cache: hashcache.ChecksumCache = None) -> UploadJob:
+    """Pipeline stage: stat, checksum and MIME type of the local file"""
+    with phase(job, 'hash'):
+        job.stat = job.path.stat()
+        job.checksum = cache.get(job.stat) if cache else None
+        if not job.checksum:
+            job.checksum = checksum(job.path, file_stat=job.stat)
+            job.bytes['hash'] = job.bytes.get('hash', 0) + job.stat.st_size
+            if cache:
+                cache.put(job.path, job.stat, job.checksum)
+    job.mime = get_mime(job.path)
+    if not job.mtime:
+        # TODO timezone
+        job.mtime = datetime.datetime.fromtimestamp(job.stat.st_mtime)
+    return job
 
-    if not mtime:
-        mtime = datetime.datetime.fromtimestamp(file_stat.st_mtime)
+def stage_job(obj_idx: clilib.ObjectIndex,
+              job: UploadJob,
+              cache: hashcache.ChecksumCache = None) -> UploadJob:
+    """Pipeline stage: hash while streaming to a staging key, so the file is read once
 
+    Falls back to hash_job if the checksum is already cached
+    """
+    job.stat = job.path.stat()
+    if cache and cache.get(job.stat):
+        return hash_job(job, cache)
+    with phase(job, 'stage', job.stat.st_size):
+        staged = obj_idx.get_staging(job.bucket, job.path.name)
+        bucket = s3lib.s3_service(staged['server']).Bucket(staged['bucket'])
+        with open(job.path, "rb") as file_obj:
+            reader = _HashingReader(file_obj)
+            bucket.upload_fileobj(reader, staged['key'], Config=s3lib.transfer_config())
+    job.staged = staged
+    assert reader.size == job.stat.st_size
+    job.checksum = reader.check.digest()
+    if cache:
+        cache.put(job.path, job.stat, job.checksum)
+    job.mime = get_mime(job.path)
+    if not job.mtime:
+        job.mtime = datetime.datetime.fromtimestamp(job.stat.st_mtime)
+    return job
+
+def _drop_staged(job: UploadJob):
+    """Remove the staging copy of a job, if any"""
+    if job.staged:
+        s3lib.s3_service(job.staged['server']).Object(job.staged['bucket'],
+                                                              job.staged['key']).delete()
+        job.staged = None
+
+def upload_args(job: UploadJob) -> dict:
+    """Keyword arguments for ObjectIndex.initiate_upload"""
+    return {'url': job.url,
+            'bucket': job.bucket,
+            'obj_size': job.stat.st_size,
+            'mtime': job.mtime,
+            'filename': job.path.name,
+            'extra_file': job.extra,
+            'checksum': job.checksum,
+            'mime': job.mime,
+            'direct': job.direct,
+            'partial': job.partial,
+            'resume': True}
+
+def register_job(obj_idx: clilib.ObjectIndex, job: UploadJob) -> UploadJob:
+    """Pipeline stage: tell ObjectIndex about the file"""
     try:
-        my_file = obj_idx.initiate_upload(url=url,
-                                          bucket=bucket,
-                                          obj_size=file_stat.st_size,
-                                          # TODO timezone
-                                          mtime=mtime,
-                                          filename=file_path.name,
-                                          extra_file=extra,
-                                          checksum=file_checksum,
-                                          mime=file_mime,
-                                          direct=direct,
-                                          partial=partial)
+        with phase(job, 'register'):
+            job.file = obj_idx.initiate_upload(**upload_args(job))
+        hold_lease(job)
     except clilib.requests.HTTPError as e:
         if e.response.status_code != 409:
             raise e
-        warnings.warn(f"Conflict for file {url} {file_checksum.hex()}... existing object {e.response.json()['object_uuid']}")
-        return None
-    if not my_file.exists():
-        s3_url = my_file.get_s3_url()
-        bucket = s3lib.get_s3_service_url(s3_url['server']).Bucket(s3_url['bucket'])
+        job.conflict = e.response.json()['object_uuid']
+        _drop_staged(job)
+    return job
+
+def register_jobs(obj_idx: clilib.ObjectIndex, jobs: list[UploadJob]) -> list[UploadJob]:
+    """Pipeline stage: tell ObjectIndex about many files in one request
+
+    Each job is timed with the whole request, the time it waited for it
+    """
+    start = time.perf_counter()
+    results = obj_idx.initiate_uploads([upload_args(job) for job in jobs])
+    for job in jobs:
+        job.seconds['register'] = time.perf_counter() - start
+    for job, (my_file, conflict, error) in zip(jobs, results):
+        job.file = my_file
+        job.conflict = conflict
+        if error:
+            job.error = ValueError(f"Index refused {job.filename}: {error}")
+            release(job)
+        elif conflict:
+            _drop_staged(job)
+        else:
+            hold_lease(job)
+    return jobs
+
+class LeaseKeeper:
+    """Renews a File's upload lease in a background thread from start() to stop()
+
+    Jobs hold one from registration on, so the lease stays alive while they
+    wait in the queue for a transfer worker too. If a renewal is refused the
+    lease was taken over and lost is set; release() hands it back early.
+    """
+    def __init__(self, fileobj: clilib.File):
+        self.fileobj = fileobj
+        self.stopped = threading.Event()
+        self.thread = None
+        self.lost = False
+
+    def renew(self):
+        """Renew the lease now"""
+        self.fileobj.oio.renew_lease(self.fileobj.info['file_object']['uuid'],
+                                     self.fileobj.lease['id'])
+
+    def keep(self):
+        """Renew every third of the lease ttl until stopped or lost"""
+        while not self.stopped.wait(self.fileobj.lease['ttl'] / 3):
+            try:
+                self.renew()
+            except clilib.requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 409:
+                    self.lost = True
+                    return
+                warnings.warn(f"Could not renew lease for {self.fileobj.uuid}: {e}")
+            except clilib.requests.RequestException as e:
+                # NOTE keep trying; a lease outlives a couple of missed renewals
+                warnings.warn(f"Could not renew lease for {self.fileobj.uuid}: {e}")
+
+    def start(self):
+        """Start renewing in the background"""
+        self.thread = threading.Thread(target=self.keep, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop renewing"""
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def release(self):
+        """Stop renewing and give the lease up, unless it was already lost"""
+        self.stop()
+        if self.lost:
+            return
+        try:
+            self.fileobj.oio.release_lease(self.fileobj.info['file_object']['uuid'],
+                                           self.fileobj.lease['id'])
+        except clilib.requests.RequestException as e:
+            # NOTE it still runs out after its ttl
+            warnings.warn(f"Could not release lease for {self.fileobj.uuid}: {e}")
+
+def hold_lease(job: UploadJob):
+    """Start keeping the upload lease of a newly registered job alive, if it has one"""
+    if job.file and not job.file.exists() and job.file.lease:
+        job.keeper = LeaseKeeper(job.file)
+        job.keeper.start()
+
+def release(job: UploadJob):
+    """Let go of what a job holds once it is done with, successfully or not
+
+    That is its lease, given up if the upload did not finish so a rerun need not
+    wait for it to run out, and its staging copy, which would otherwise stay in the bucket
+    """
+    if job.keeper:
+        if job.file.object and job.file.object['completed']:
+            job.keeper.stop()
+        else:
+            job.keeper.release()
+        job.keeper = None
+    try:
+        _drop_staged(job)
+    except Exception as e:  # pylint: disable=broad-except
+        warnings.warn(f"Could not remove staging copy of {job.filename}: {e!r}")
+
+
+def transfer_job(job: UploadJob) -> UploadJob:
+    """Pipeline stage: send file contents to S3 if needed and mark it finished"""
+    try:
+        if job.file and not job.file.exists():
+            if job.keeper and job.keeper.lost:
+                raise ValueError(f"Upload lease on {job.file.uuid} was lost while queued")
+            _transfer(job)
+            with phase(job, 'finish'):
+                job.file.finish_upload()
+    finally:
+        release(job)
+    return job
+
+def _transfer(job: UploadJob):
+    """Copy or upload the contents of a job being uploaded"""
+    s3_url = job.file.get_s3_url()
+    bucket = s3lib.s3_service(s3_url['server']).Bucket(s3_url['bucket'])
+    if job.staged:
+        with phase(job, 'copy'):
+            _copy_staged(job, s3_url, bucket)
+    else:
+        with phase(job, 'transfer', job.stat.st_size):
+            _upload(job, s3_url, bucket)
+
+def _copy_staged(job: UploadJob, s3_url: dict, bucket):
+    """Server side copy of a job's staging key to its object key"""
+    # NOTE staging is always in the destination bucket
+    assert job.staged['bucket'] == s3_url['bucket']
+    if job.file.multipart:
+        # The copy makes the unfinished multipart upload we were handed moot
+        multipart.abort(s3lib.s3_client(s3_url['server']), s3_url['bucket'],
+                        s3_url['key'], job.file.multipart['upload_id'])
+    bucket.copy({'Bucket': job.staged['bucket'], 'Key': job.staged['key']},
+                s3_url['key'], Config=s3lib.transfer_config())
+
+def _upload(job: UploadJob, s3_url: dict, bucket):
+    """Upload a job's file to its object key"""
+    config = s3lib.transfer_config()
+    if job.file.multipart or job.stat.st_size >= config.multipart_threshold:
+        # NOTE our own multipart so its progress is kept in the index for resuming
+        multipart.upload_file(job.file, job.filename, config.max_concurrency,
+                              config.multipart_chunksize)
+    else:
         # TODO send checksum; see https://github.com/boto/boto3/issues/3604
-        bucket.upload_file(filename, s3_url['key'])
-        my_file.finish_upload()
-    return my_file
+        bucket.upload_file(job.filename, s3_url['key'], Config=config)
+
+def run_job(obj_idx: clilib.ObjectIndex,
+            job: UploadJob,
+            cache: hashcache.ChecksumCache = None) -> UploadJob:
+    """Run all stages of a job in this thread"""
+    return transfer_job(register_job(obj_idx, hash_job(job, cache)))
+
+
+_DONE = object()
+
+def _take(inq: queue.Queue, batch: int) -> list:
+    """Get one job from inq, plus up to batch-1 more that are already waiting"""
+    jobs = [inq.get()]
+    while len(jobs) < batch and jobs[-1] is not _DONE:
+        try:
+            jobs.append(inq.get_nowait())
+        except queue.Empty:
+            break
+    return jobs
+
+def _stage(func, inq: queue.Queue, outq: queue.Queue, workers: int, batch: int = 0) -> list:
+    """Start worker threads feeding jobs from inq through func into outq
+
+    If batch is set func takes and returns a list of up to that many jobs.
+    A failing job is passed along with its error set rather than stopping the
+    stage, after letting go of whatever it holds
+    """
+    remaining = [workers]
+    lock = threading.Lock()
+    def work():
+        while True:
+            jobs = _take(inq, batch)
+            done = jobs[-1] is _DONE
+            if done:
+                jobs.pop()
+            todo = [job for job in jobs if job.error is None and job.conflict is None]
+            try:
+                if batch and todo:
+                    func(todo)
+                else:
+                    for job in todo:
+                        try:
+                            func(job)
+                        except Exception as e:  # pylint: disable=broad-except
+                            job.error = e
+                            release(job)
+            except Exception as e:  # pylint: disable=broad-except
+                for job in todo:
+                    job.error = e
+                    release(job)
+            for job in jobs:
+                outq.put(job)
+            if done:
+                inq.put(_DONE)  # let sibling workers see it too
+                break
+        with lock:
+            remaining[0] -= 1
+            if not remaining[0]:
+                outq.put(_DONE)
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def upload_jobs(obj_idx: clilib.ObjectIndex,
+                jobs,
+                hash_workers: int = 1,
+                transfer_workers: int = 1,
+                register_workers: int = None,
+                queue_size: int = QUEUE_SIZE,
+                cache: hashcache.ChecksumCache = None,
+                single_read: bool = False,
+                register_batch: int = 0):
+    """Run jobs through a pipeline of hash, register and transfer worker pools
+
+    Queues between stages are bounded so hashing does not run far ahead of transfers.
+    Yields each job as it finishes, in completion order; check job.file, job.conflict
+    and job.error on the way out. If the jobs iterable itself raises, the jobs
+    already fed in are finished and then the exception is raised here.
+
+    With single_read the hash stage uses stage_job, so hash workers also do the upload.
+    With register_batch jobs waiting to be registered go to POST /upload/batch together.
+    """
+    if not register_workers:
+        register_workers = transfer_workers
+    hashq = queue.Queue(queue_size)
+    registerq = queue.Queue(queue_size)
+    transferq = queue.Queue(queue_size)
+    doneq = queue.Queue()
+    if single_read:
+        _stage(lambda job: stage_job(obj_idx, job, cache), hashq, registerq, hash_workers)
+    else:
+        _stage(lambda job: hash_job(job, cache), hashq, registerq, hash_workers)
+    if register_batch:
+        _stage(lambda jobs: register_jobs(obj_idx, jobs), registerq, transferq, register_workers,
+               register_batch)
+    else:
+        _stage(lambda job: register_job(obj_idx, job), registerq, transferq, register_workers)
+    _stage(transfer_job, transferq, doneq, transfer_workers)
+    failed = []
+    def feed():
+        try:
+            for job in jobs:
+                hashq.put(job)
+        except BaseException as e:  # pylint: disable=broad-except
+            failed.append(e)
+        finally:
+            hashq.put(_DONE)
+    threading.Thread(target=feed, daemon=True).start()
+    while True:
+        job = doneq.get()
+        if job is _DONE:
+            break
+        yield job
+    if failed:
+        raise failed[0]
+
+def upload(filename: str, obj_idx: clilib.ObjectIndex, bucket: str, tags: dict,
+           cache: hashcache.ChecksumCache = None) -> clilib.File:
+    """Run an actual file upload into ObjIdx and S3"""
+    # TODO consider refactoring information gathering with mediacrawler fs.File.get_media()
+    job = hash_job(UploadJob(filename, bucket, extra=tags), cache)
+    job.file = obj_idx.initiate_upload(url=job.url,
+                                       bucket=bucket,
+                                       obj_size=job.stat.st_size,
+                                       mtime=job.mtime,
+                                       filename=job.path.name,
+                                       extra_file=tags,
+                                       checksum=job.checksum,
+                                       mime=job.mime)
+    hold_lease(job)
+    return transfer_job(job).file
+
+def scan_tree(root: str):
+    """DirEntry of every regular file under root, not following symlinks"""
+    todo = [root]
+    while todo:
+        with os.scandir(todo.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    todo.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+def indexed_files(obj_idx: clilib.ObjectIndex, prefix: str) -> dict:
+    """(mtime, size) pairs of completed uploads of each file URL starting with prefix"""
+    indexed = {}
+    for info in obj_idx.stream_files({'url': f"{prefix}*"}, SYNC_FIELDS):
+        if info['file_object'] and info['file_object']['completed'] and info['mtime']:
+            # NOTE stored naive, like hash_job makes them
+            mtime = datetime.datetime.fromisoformat(info['mtime']).replace(tzinfo=None)
+            indexed.setdefault(info['url'], set()).add((mtime, info['file_object']['obj_size']))
+    return indexed
+
+def sync_jobs(obj_idx: clilib.ObjectIndex, root: str, bucket: str,
+              extra: dict = None, counts: dict = None):
+    """UploadJobs for the files under root that are new or changed since last indexed
+
+    Files are compared by URL, size and mtime against a single streamed listing
+    of the URLs under root, so unchanged ones are never hashed or registered.
+    counts, if given, gets the number of files 'scanned' and 'skipped'
+    """
+    if counts is None:
+        counts = {}
+    counts.setdefault('scanned', 0)
+    counts.setdefault('skipped', 0)
+    root = pathlib.Path(root).absolute()
+    indexed = indexed_files(obj_idx, file_url(root).rstrip('/') + '/')
+    for entry in scan_tree(str(root)):
+        counts['scanned'] += 1
+        path = pathlib.Path(entry.path)
+        url = file_url(path)
+        file_stat = entry.stat(follow_symlinks=False)
+        if (datetime.datetime.fromtimestamp(file_stat.st_mtime),
+                file_stat.st_size) in indexed.get(url, ()):
+            counts['skipped'] += 1
+            continue
+        yield UploadJob(entry.path, bucket, url=url, extra=extra)
+
+def get_obj_idx(url, user, pool_size=clilib.POOL_SIZE):
+    """Get ObjectIndex object"""
+    # TODO add in user and auth
+    return clilib.ObjectIndex(url, host=socket.gethostname(), sw=SW_STRING, user=user,
+                              pool_size=pool_size)
+
+def download(obj_idx: clilib.ObjectIndex, url: str, pretend: bool = False,
+             output_dir: str = '.', jobs: int = 1) -> list[clilib.File]:
+    """Download a file with given original URL"""
+    files = list(obj_idx.search_files({'url': url}))
+    if not pretend:
+        download_files(files, output_dir, jobs)
+    return files
+
+def downloadable(file: clilib.File) -> bool:
+    """Whether the object behind a file is uploaded; if not warn that it is skipped"""
+    if not file.object or not file.object['completed'] or file.object.get('deleted'):
+        warnings.warn(f"Skipping {file.info['url']} ({file.uuid}): no uploaded object")
+        return False
+    return True
+
+def download_files(files: list[clilib.File], output_dir: str = '.', jobs: int = 1,
+                   done: dict = None, chunk_size: int = fetch.CHUNK_SIZE) -> dict:
+    """Download the object behind each file once, verified against its checksum
+
+    Files are saved under output_dir named by S3 key; done maps object UUIDs
+    already fetched to their path and is updated and returned. Files whose object
+    is not (or no longer) uploaded are warned about and skipped
+    """
+    if done is None:
+        done = {}
+    for file in files:
+        if not downloadable(file):
+            continue
+        if file.object['uuid'] in done:
+            continue
+        s3_url = file.get_s3_url()
+        done[file.object['uuid']] = fetch.download_object(s3_url,
+                                                          bytes.fromhex(file.object['checksum']),
+                                                          file.object['obj_size'],
+                                                          pathlib.Path(output_dir, s3_url['key']),
+                                                          jobs, chunk_size)
+    return done
+
+def upload_metadata(filename: str,
+                    obj_idx: clilib.ObjectIndex,
+                    bucket: str,
+                    url: str,
+                    mtime: datetime.datetime = None,
+                    direct: bool = True,
+                    partial: bool = False,
+                    library: str = None,
+                    person: str = None,
+                    media: str = None,
+                    ytdl_info: dict = None,
+                    extra: dict = None,
+                    cache: hashcache.ChecksumCache = None) -> clilib.File:
+    """Upload file with metadata"""
+    job = run_job(obj_idx,
+                  metadata_job(filename, bucket, url, mtime, direct, partial,
+                               library, person, media, ytdl_info, extra),
+                  cache)
+    if job.conflict:
+        warnings.warn(f"Conflict for file {url} {job.checksum.hex()}... existing object {job.conflict}")
+        return None
+    return job.file
@@ -1,9 +1,23 @@
 """ObjectIndex client library"""
 
+import copy
 import datetime
+import json
 import uuid
 from urllib.parse import urljoin
 import requests
+import requests.adapters
+import urllib3.util.retry
+from . import lrucache
+
+POOL_SIZE = 10
+RETRIES = 3
+BACKOFF = 0.5
+RETRY_STATUS = (502, 503, 504)
+# NOTE POST /upload/ is not safe to repeat; a retry would conflict with our own upload
+RETRY_METHODS = frozenset(['GET', 'HEAD', 'PUT'])
+CACHE_SIZE = 256
+PRESIGN_BATCH = 1000  # objects per POST object/presigned, well under the API's cap
 
 
 class File:
@@ -17,13 +31,18 @@ class File:
         self.s3_url = None
         self.object_url = None
         self.object_exists = None
+        self.multipart = None
+        self.lease = None
     def set_info(self, info: dict):
         """Set info returned typically from GET /file/x"""
         self.info = info.copy()
         if info.get('file_object'):
             self.object = info['file_object'].copy()
-    def set_upload(self, exists: bool, s3_url: str, object_url: str = None):
-        """Set info from POST /upload/"""
+    def set_upload(self, exists: bool, s3_url: str, object_url: str = None,
+                   multipart: dict = None, lease: dict = None):
+        """Set info from POST /upload/; multipart is set when resuming one"""
+        self.multipart = multipart
+        self.lease = lease
         if exists is not None:
             self.object_exists = exists
         if s3_url:
@@ -48,6 +67,7 @@ class File:
         # NOTE this does not use ObjectIndex.put_object... maybe it should!
         assert self.object_url
         self.object = self.oio.put(self.object_url, json={"completed": True})
+        assert self.object['completed']
         # TODO should this update self.object_exists?
     def exists(self):
         """Has this file already been uploaded?"""
@@ -56,48 +76,93 @@ class File:
 
 
 class ObjectIndex:
-    """Interface with an ObjectIndex API instance"""
-    def __init__(self, url, user=None, sw=None, host=None):
+    """Interface with an ObjectIndex API instance
+
+    Calls go through one keep-alive requests.Session, which may be shared between threads.
+    GET answers with an ETag are kept in an LRU of cache_size and revalidated with
+    If-None-Match, or not asked for again at all if marked immutable
+    """
+    def __init__(self, url, user=None, sw=None, host=None,
+                 pool_size=POOL_SIZE, retries=RETRIES, backoff=BACKOFF, cache_size=CACHE_SIZE):
         self.url = url
         self.user = user
         self.sw = sw
         self.host = host
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        self.mount(pool_size)
+        self.validators = lrucache.LRUCache(cache_size)
+
+    def mount(self, pool_size=POOL_SIZE):
+        """(Re)size the HTTP connection pool; should be at least the number of threads using it"""
+        retry = urllib3.util.retry.Retry(total=self.retries,
+                                         backoff_factor=self.backoff,
+                                         status_forcelist=RETRY_STATUS,
+                                         allowed_methods=RETRY_METHODS,
+                                         raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size,
+                                                max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
-    # TODO combine put/post/get to single function
+    def send(self, method, url, **kwargs) -> requests.Response:
+        """Run an API call and return the response, raising for HTTP errors"""
+        result = self.session.request(method, urljoin(self.url, url), **kwargs)
+        result.raise_for_status()
+        return result
+
+    def request(self, method, url, **kwargs):
+        """Run an API call and return the decoded JSON"""
+        return self.send(method, url, **kwargs).json()
 
     def put(self, url, json):
         """Run an API PUT/PATCH"""
-        result = requests.put(urljoin(self.url, url), json=json)
-        result.raise_for_status()
-        return result.json()
+        return self.request('PUT', url, json=json)
 
     def post(self, url, json):
         """Run an API POST"""
-        result = requests.post(urljoin(self.url, url), json=json)
-        result.raise_for_status()
-        return result.json()
+        return self.request('POST', url, json=json)
 
     def get(self, url, params=None):
-        """Run an API GET"""
-        result = requests.get(urljoin(self.url, url), params=params)
-        result.raise_for_status()
-        return result.json()
+        """Run an API GET, reusing an earlier answer if the API says it is still valid"""
+        key = (url, tuple(sorted(params.items())) if params else ())
+        cached = self.validators.get(key)
+        if cached and cached['immutable']:
+            return copy.deepcopy(cached['info'])
+        headers = {'If-None-Match': cached['etag']} if cached else {}
+        result = self.send('GET', url, params=params, headers=headers)
+        if result.status_code == 304:
+            return copy.deepcopy(cached['info'])
+        info = result.json()
+        if result.headers.get('ETag'):
+            self.validators.put(key, {'etag': result.headers['ETag'],
+                                      'immutable': 'immutable' in result.headers.get('Cache-Control', ''),
+                                      'info': copy.deepcopy(info)})
+        return info
 
-    def initiate_upload(self, url: str, bucket: str, obj_size: int, checksum: bytes,
-                        direct: bool = True,
-                        mtime: datetime.datetime = None,
-                        filename: str = None,
-                        mime: str = None,
-                        partial: bool = False,
-                        extra_file: dict = None,
-                        extra_object: dict = None) -> File:
-        """Kick off an upload of a file with given info and return a File object"""
+    def upload_payload(self, url: str, bucket: str, obj_size: int, checksum: bytes,
+                       direct: bool = True,
+                       mtime: datetime.datetime = None,
+                       filename: str = None,
+                       mime: str = None,
+                       partial: bool = False,
+                       extra_file: dict = None,
+                       extra_object: dict = None,
+                       resume: bool = False) -> dict:
+        """Build the JSON body for POST /upload/
+
+        With resume an unfinished multipart upload of the same object, whose
+        lease ran out, is handed back to continue rather than started over
+        """
         payload = {"url": url,
                    "bucket": bucket,
                    "obj_size": obj_size,
                    "checksum": checksum.hex(),
                    "direct": direct,
-                   "partial": partial}
+                   "partial": partial,
+                   "resume": resume}
         if mtime:
             payload["mtime"] = mtime.isoformat()  # TODO consider timezone
         if self.user:
@@ -114,28 +179,129 @@ class ObjectIndex:
             payload["filename"] = filename
         if mime:
             payload["mime"] = mime
-        info = self.post('upload/', json=payload)
+        return payload
+
+    def _upload_file(self, info: dict) -> File:
+        """Make a File out of an UploadResult"""
         fileobj = File(self, uuid.UUID(info['file']['uuid']))
         fileobj.set_info(info['file'])
         # NOTE the object_url is relative to the OI API URL
         #      this is OK though because fileobj.oio.url has it
         fileobj.set_upload(exists=info['exists'],
                            s3_url=(info['download'] if info['exists'] else info['upload']['s3']),
-                           object_url=(None if info['exists'] else info['upload']['finished']))
+                           object_url=(None if info['exists'] else info['upload']['finished']),
+                           multipart=info.get('multipart'),
+                           lease=info.get('lease'))
         return fileobj
 
+    def initiate_upload(self, url: str, bucket: str, obj_size: int, checksum: bytes,
+                        direct: bool = True,
+                        mtime: datetime.datetime = None,
+                        filename: str = None,
+                        mime: str = None,
+                        partial: bool = False,
+                        extra_file: dict = None,
+                        extra_object: dict = None,
+                        resume: bool = False) -> File:
+        """Kick off an upload of a file with given info and return a File object"""
+        payload = self.upload_payload(url, bucket, obj_size, checksum, direct, mtime, filename,
+                                      mime, partial, extra_file, extra_object, resume)
+        return self._upload_file(self.post('upload/', json=payload))
+
+    def initiate_uploads(self, uploads: list[dict]) -> list[tuple]:
+        """Kick off uploads of many files in one request
+
+        Each item of uploads holds the keyword arguments of initiate_upload.
+        Returns a list of (File, None, None), for a conflict (None, conflicting object
+        UUID, None) or, for one the index refused, (None, None, the reason)
+        """
+        payloads = [self.upload_payload(**upload) for upload in uploads]
+        results = []
+        for info in self.post('upload/batch', json={"uploads": payloads}):
+            if info['status'] == 'error':
+                results.append((None, None, info['message']))
+            elif info['status'] == 'conflict':
+                results.append((None, info['object_uuid'], None))
+            else:
+                results.append((self._upload_file(info), None, None))
+        return results
+
+    def get_staging(self, bucket: str, filename: str = None) -> dict:
+        """Get an S3 location to upload to before the checksum is known"""
+        payload = {"bucket": bucket}
+        if filename:
+            payload["filename"] = filename
+        return self.post('upload/staging', json=payload)
+
+    def start_multipart(self, object_uuid, upload_id: str, part_size: int) -> dict:
+        """Record the S3 multipart upload of an object being uploaded"""
+        return self.put(f"object/{object_uuid}/multipart",
+                        json={"upload_id": upload_id, "part_size": part_size})
+
+    def put_part(self, object_uuid, upload_id: str, number: int, etag: str, size: int) -> dict:
+        """Record a part of a multipart upload as done"""
+        return self.put(f"object/{object_uuid}/multipart/{number}",
+                        json={"upload_id": upload_id, "etag": etag, "size": size})
+
+    def renew_lease(self, object_uuid, lease_id) -> dict:
+        """Extend the upload lease on an object; HTTPError 409 if it was lost"""
+        return self.put(f"object/{object_uuid}/lease", json={"id": str(lease_id)})
+
+    def release_lease(self, object_uuid, lease_id) -> dict:
+        """Give up the upload lease on an object so another upload can take it over now"""
+        return self.request('DELETE', f"object/{object_uuid}/lease", params={"id": str(lease_id)})
+
+    def clear_multipart(self, object_uuid):
+        """Forget the multipart upload of an object, e.g. after aborting it"""
+        self.send('DELETE', f"object/{object_uuid}/multipart")
+
     def put_object(self, object_uuid: uuid.UUID, info: dict):
         """PUT/PATCH an object"""
         # TODO implement
 
-    def search_files(self, params):
-        """Search for files with given parameters"""
+    def search_files_page(self, params, cursor=None, limit=None) -> tuple:
+        """Get one page of a file search
+
+        Returns a list of File and the cursor for the next page, None if this was the last
+        """
+        params = dict(params)
+        if cursor:
+            params['cursor'] = cursor
+        if limit:
+            params['limit'] = limit
+        result = self.send('GET', 'file/', params=params)
         files = []
-        for file in self.get('file/', params):
+        for file in result.json():
             file_obj = File(self, file['uuid'])
             file_obj.set_info(file)
             files.append(file_obj)
-        return files
+        return files, result.headers.get('X-Next-Cursor')
+
+    def search_files(self, params, limit=None):
+        """Search for files with given parameters
+
+        This is a generator fetching further pages only as they are needed
+        """
+        cursor = None
+        while True:
+            files, cursor = self.search_files_page(params, cursor, limit)
+            yield from files
+            if not cursor:
+                break
+
+    def stream_files(self, params, fields=None):
+        """Every file matching a search as plain dicts, streamed as NDJSON in one request
+
+        fields limits what is sent back, e.g. ['url', 'file_object.obj_size']
+        """
+        params = dict(params)
+        if fields:
+            params['fields'] = ','.join(fields)
+        with self.send('GET', 'file/', params=params, stream=True,
+                       headers={'Accept': 'application/x-ndjson'}) as result:
+            for line in result.iter_lines():
+                if line:
+                    yield json.loads(line)
 
     def get_file(self, fileid, with_info=True):
         """Get file object for given UUID"""
@@ -157,3 +323,18 @@ class ObjectIndex:
         """Get presigned URL for a given object"""
         # TODO merge with File.get_s3
         return self.get(f"object/{objid}/download", params={"presigned":"true"})["presigned"]
+
+    def get_presigned_many(self, objids, expires=None) -> dict:
+        """Get presigned URLs for many objects, as a dict by object UUID
+
+        One call per PRESIGN_BATCH objects; unknown objects map to None
+        """
+        objids = [str(objid) for objid in objids]
+        presigned = {}
+        for start in range(0, len(objids), PRESIGN_BATCH):
+            payload = {"objects": objids[start:start + PRESIGN_BATCH]}
+            if expires:
+                payload["expires"] = expires
+            presigned.update((info['uuid'], info['presigned'])
+                             for info in self.post('object/presigned', json=payload))
+        return presigned
@@ -20,14 +20,35 @@ class Object(db.Model):
     bucket = db.Column(db.String(63), nullable=False)
     key = db.Column(db.String(1023), nullable=False)
     obj_size = db.Column(db.BigInteger, nullable=False) # NOTE Postgres doesn't support unsigned
-    checksum = db.Column(db.LargeBinary(32), index=True)
+    checksum = db.Column(db.LargeBinary(32))
     ctime = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
     mime = db.Column(db.String(255))
     completed = db.Column(db.Boolean, default=False, nullable=False)
     deleted = db.Column(db.Boolean, default=False, nullable=False)
-    extra = db.Column(JSONB)
-    files = db.relationship('File', backref='file_object', lazy=True)
-    __table_args__ = (db.Index('buckey', "bucket", "key"), )
+    # NOTE deferred as it may hold large blobs like ytdl-info; undefer when needed
+    extra = db.deferred(db.Column(JSONB(none_as_null=True)))
+    # S3 multipart upload in progress, so a crashed upload can be resumed or aborted
+    mpu_id = db.Column(db.String(1023))
+    mpu_part_size = db.Column(db.BigInteger)
+    mpu_time = db.Column(db.DateTime)  # last multipart activity
+    lease_id = db.Column(UUID(as_uuid=True))  # held by whoever is uploading
+    lease_expires = db.Column(db.DateTime)
+    verified = db.Column(db.DateTime)  # last time the scrubber re-read it
+    verify_ok = db.Column(db.Boolean)
+    files = db.relationship('File', back_populates='file_object', lazy=True)
+    parts = db.relationship('Part', lazy=True, order_by='Part.number')
+    __table_args__ = (db.Index('uq_object_checksum', "checksum", unique=True),
+                      db.Index('ix_object_mpu_time', "mpu_time",
+                               postgresql_where=db.text('mpu_id IS NOT NULL')),
+                      db.Index('ix_object_lease_expires', "lease_expires",
+                               postgresql_where=db.text('NOT completed AND NOT deleted')))
+
+class Part(db.Model):
+    """Part table: uploaded parts of an object's multipart upload"""
+    obj_uuid = db.Column(UUID(as_uuid=True), db.ForeignKey('object.uuid'), primary_key=True)
+    number = db.Column(db.Integer, primary_key=True)
+    etag = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
 
 class File(db.Model):
     """File table"""
@@ -41,10 +62,25 @@ class File(db.Model):
     url = db.Column(db.String(2047), index=True, nullable=False)
     direct = db.Column(db.Boolean, default=True, nullable=False)
     partial = db.Column(db.Boolean, default=False, nullable=False)
-    extra = db.Column(JSONB)
+    extra = db.deferred(db.Column(JSONB(none_as_null=True)))
     ul_user = db.Column(db.String(15))
     ul_sw = db.Column(db.String(15))
     ul_host = db.Column(db.String(64))
+    # NOTE declared here rather than as a backref so api can name it in loader options at import
+    file_object = db.relationship('Object', back_populates='files')
+    __table_args__ = (db.Index('uq_file_url_obj_uuid', "url", "obj_uuid", unique=True),
+                      db.Index('ix_file_ctime_uuid', "ctime", "uuid"),
+                      db.Index('ix_file_extra', "extra",
+                               postgresql_using='gin',
+                               postgresql_ops={'extra': 'jsonb_path_ops'}))
+
+# NOTE C collation lets URL prefix LIKE use this index whatever the database collation
+db.Index('ix_file_url_c', File.url.collate('C'), File.uuid)
+# NOTE and this one walk keys in the byte order S3 lists them in, for reconciling
+db.Index('buckey', Object.bucket, Object.key.collate('C'))
+# NOTE the order the scrubber goes through objects in
+db.Index('ix_object_verified', Object.verified.asc().nulls_first(), Object.uuid,
+         postgresql_where=db.text('completed AND NOT deleted'))
 
 
 
@@ -0,0 +1,63 @@
+"""Run this module to bring an existing database up to the current schema
+
+Unlike db_create this keeps the data; every statement is safe to run again
+"""
+
+import sys
+from . import db
+
+# Rows that would break a unique index below; these need merging by hand first
+CHECKS = [
+    'SELECT encode(checksum, \'hex\') FROM object GROUP BY checksum HAVING count(*) > 1',
+    'SELECT url, obj_uuid FROM file GROUP BY url, obj_uuid HAVING count(*) > 1',
+]
+
+STATEMENTS = [
+    'CREATE INDEX IF NOT EXISTS ix_file_ctime_uuid ON file (ctime, uuid)',
+    'CREATE INDEX IF NOT EXISTS ix_file_extra ON file USING gin (extra jsonb_path_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_file_url_c ON file (url COLLATE "C", uuid)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS uq_object_checksum ON object (checksum)',
+    'DROP INDEX IF EXISTS ix_object_checksum',
+    'CREATE UNIQUE INDEX IF NOT EXISTS uq_file_url_obj_uuid ON file (url, obj_uuid)',
+    'ALTER TABLE object ADD COLUMN IF NOT EXISTS mpu_id varchar(1023)',
+    'ALTER TABLE object ADD COLUMN IF NOT EXISTS mpu_part_size bigint',
+    'ALTER TABLE object ADD COLUMN IF NOT EXISTS mpu_time timestamp',
+    'CREATE INDEX IF NOT EXISTS ix_object_mpu_time ON object (mpu_time) WHERE mpu_id IS NOT NULL',
+    'CREATE TABLE IF NOT EXISTS part (obj_uuid uuid NOT NULL REFERENCES object (uuid), '
+    'number integer NOT NULL, etag varchar(255) NOT NULL, size bigint NOT NULL, '
+    'PRIMARY KEY (obj_uuid, number))',
+    'ALTER TABLE object ADD COLUMN IF NOT EXISTS lease_id uuid',
+    'ALTER TABLE object ADD COLUMN IF NOT EXISTS lease_expires timestamp',
+    'CREATE INDEX IF NOT EXISTS ix_object_lease_expires ON object (lease_expires) '
+    'WHERE NOT completed AND NOT deleted',
+    # NOTE byte order, the same as S3 listings, for obj-idx-admin reconcile
+    'DROP INDEX IF EXISTS buckey',
+    'CREATE INDEX buckey ON object (bucket, key COLLATE "C")',
+    'ALTER TABLE object ADD COLUMN IF NOT EXISTS verified timestamp',
+    'ALTER TABLE object ADD COLUMN IF NOT EXISTS verify_ok boolean',
+    'CREATE INDEX IF NOT EXISTS ix_object_verified ON object (verified NULLS FIRST, uuid) '
+    'WHERE completed AND NOT deleted',
+]
+
+# Older versions stored a missing extra as JSON null rather than SQL NULL, which the
+# coalesce filling it in on a later upload does not see as missing
+NULL_EXTRA = [
+    "UPDATE object SET extra = NULL WHERE extra = 'null'::jsonb",
+    "UPDATE file SET extra = NULL WHERE extra = 'null'::jsonb",
+]
+STATEMENTS.extend(NULL_EXTRA)
+
+def main():
+    """Check for duplicates, then run every statement in one transaction"""
+    with db.db.engine.begin() as conn:
+        duplicates = [row for check in CHECKS for row in conn.execute(db.db.text(check))]
+        if duplicates:
+            for row in duplicates:
+                print('duplicate', *row)
+            sys.exit("Merge the duplicates above before upgrading")
+        for statement in STATEMENTS:
+            print(statement)
+            conn.execute(db.db.text(statement))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Fast path for sending many rows: NDJSON lines, optional orjson and compression
+
+orjson and zstandard are used when installed (the objectindex[fast] extra);
+without them this falls back to json and gzip/identity
+"""
+
+import json
+import zlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+NDJSON = 'application/x-ndjson'
+CHUNK_ROWS = 500
+
+
+def dumps(value) -> bytes:
+    """Encode value as compact JSON bytes"""
+    if orjson:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode()
+
+def row_encoder(model):
+    """Function turning one row into an NDJSON line per model
+
+    Same output as flask_restx.marshal but without its per call setup
+    """
+    items = list(model.items())
+    def encode(row):
+        return dumps({name: field.output(name, row) for name, field in items}) + b'\n'
+    return encode
+
+def encodings():
+    """Content-Encodings we can produce, best first"""
+    return (['zstd'] if zstandard else []) + ['gzip']
+
+def compressor(encoding):
+    """Streaming compress object for a Content-Encoding, or None for identity"""
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compressobj()
+    if encoding == 'gzip':
+        # NOTE fastest level; on a Pi CPU runs out before bandwidth does
+        return zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return None
+
+def stream(rows, encode, encoding=None, chunk_rows=CHUNK_ROWS):
+    """Yield the encoded rows in chunks, compressed as per encoding"""
+    comp = compressor(encoding)
+    lines = []
+    for row in rows:
+        lines.append(encode(row))
+        if len(lines) >= chunk_rows:
+            data = b''.join(lines)
+            lines = []
+            data = comp.compress(data) if comp else data
+            if data:
+                yield data
+    data = b''.join(lines)
+    if comp:
+        data = comp.compress(data) + comp.flush()
+    if data:
+        yield data
@@ -0,0 +1,110 @@
+"""Download engine: parallel ranged GETs, resumable, verified while writing
+
+Chunks are fetched by up to jobs threads into TARGET.part at their offsets; the
+main thread hashes them strictly in order as they come in, so the SHA-256 is
+done when the last byte lands. TARGET.part.json records which chunks are on
+disk so an interrupted download picks up where it stopped (those chunks are
+re-read from disk for the hash). Nothing is renamed to TARGET unless the
+checksum matches the one the index has.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+from . import s3lib
+
+CHUNK_SIZE = 8388608
+RETRIES = 3
+
+
+def _state_path(part: pathlib.Path) -> pathlib.Path:
+    return part.with_name(part.name + '.json')
+
+def load_state(part: pathlib.Path, checksum: bytes, size: int, chunk_size: int) -> set:
+    """Chunks already on disk from an earlier attempt at this very object"""
+    try:
+        state = json.loads(_state_path(part).read_text())
+    except (FileNotFoundError, ValueError):
+        return set()
+    if (state.get('checksum') != checksum.hex() or state.get('size') != size
+            or state.get('chunk_size') != chunk_size or not part.exists()):
+        return set()
+    return set(state['done'])
+
+def save_state(part: pathlib.Path, checksum: bytes, size: int, chunk_size: int, done: set):
+    """Record the chunks on disk, replacing the sidecar atomically"""
+    state = _state_path(part)
+    temp = state.with_name(state.name + '.tmp')
+    temp.write_text(json.dumps({'checksum': checksum.hex(),
+                                'size': size,
+                                'chunk_size': chunk_size,
+                                'done': sorted(done)}))
+    os.replace(temp, state)
+
+def _fetch(s3_client, s3_url: dict, fd: int, start: int, end: int) -> bytes:
+    """GET one byte range and write it at its offset"""
+    for attempt in range(RETRIES):
+        try:
+            data = s3_client.get_object(Bucket=s3_url['bucket'],
+                                        Key=s3_url['key'],
+                                        Range=f"bytes={start}-{end - 1}")['Body'].read()
+            assert len(data) == end - start
+            break
+        except Exception:  # pylint: disable=broad-except
+            if attempt == RETRIES - 1:
+                raise
+    os.pwrite(fd, data, start)
+    return data
+
+def download_object(s3_url: dict,
+                    checksum: bytes,
+                    size: int,
+                    target: pathlib.Path,
+                    jobs: int = 1,
+                    chunk_size: int = CHUNK_SIZE) -> pathlib.Path:
+    """Download an object to target with up to jobs range requests in flight
+
+    Resumes from target.part if an earlier attempt left one; raises ValueError
+    (and discards the partial data) if the result does not match checksum
+    """
+    target = pathlib.Path(target)
+    part = target.with_name(target.name + '.part')
+    chunks = -(-size // chunk_size)
+    done = load_state(part, checksum, size, chunk_size)
+    s3_client = s3lib.s3_client(s3_url['server'], max(jobs, s3lib.MAX_POOL_CONNECTIONS))
+    check = hashlib.sha256()
+    fd = os.open(part, os.O_RDWR | os.O_CREAT)
+    try:
+        os.ftruncate(fd, size)
+        # NOTE a window of twice the workers keeps them busy while bounding memory
+        window = 2 * jobs
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            pending = {}
+            next_submit = 0
+            for index in range(chunks):
+                while next_submit < chunks and next_submit < index + window:
+                    if next_submit not in done:
+                        start = next_submit * chunk_size
+                        pending[next_submit] = pool.submit(_fetch, s3_client, s3_url, fd, start,
+                                                           min(start + chunk_size, size))
+                    next_submit += 1
+                if index in pending:
+                    check.update(pending.pop(index).result())
+                    done.add(index)
+                    save_state(part, checksum, size, chunk_size, done)
+                else:
+                    start = index * chunk_size
+                    check.update(os.pread(fd, min(chunk_size, size - start), start))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    if check.digest() != checksum:
+        part.unlink()
+        _state_path(part).unlink(missing_ok=True)
+        raise ValueError(f"Checksum mismatch for {s3_url['key']}: "
+                         f"got {check.hexdigest()}, expected {checksum.hex()}")
+    os.replace(part, target)
+    _state_path(part).unlink(missing_ok=True)
+    return target
@@ -1,31 +1,35 @@
 """Object Index GUI"""
 
+import random
 from urllib.parse import urlparse, urlunparse
-from pathlib import PurePath
+from pathlib import PurePath, PurePosixPath
 import flask
-from . import client
+from . import client, metrics
 
 def get_api():
-    """Get obj_index api object"""
-    if 'oiapi' not in flask.g:
-        # TODO let user authenticate into app
-        flask.g.oiapi = client.get_obj_idx(flask.current_app.config['OBJIDX_URL'],
-                                           flask.current_app.config['OBJIDX_AUTH'])
-
-    return flask.g.oiapi
+    """Get obj_index api object
 
+    One is shared by all requests so its HTTP connections to the API are reused
+    """
+    extensions = flask.current_app.extensions
+    config = flask.current_app.config
+    if 'oiapi' not in extensions:
+        # TODO let user authenticate into app
+        extensions['oiapi'] = client.get_obj_idx(config['OBJIDX_URL'],
+                                                 config['OBJIDX_AUTH'],
+                                                 config.get('OBJIDX_POOL', client.clilib.POOL_SIZE))
+    return extensions['oiapi']
 
-def close_api(e=None):
-    """Remove obj_index api object"""
-    _ = flask.g.pop('oiapi', None)
 
-    #if  is not None:
-    #    db.close()
+# only what list.html shows, so big extra blobs never leave the database
+LIST_FIELDS = 'uuid,url,mtime,file_object.obj_size'
+PLAYLIST_FIELDS = 'uuid,url,file_object.uuid,file_object.mime'
+PLAYLISTS = {'m3u': ('playlist.m3u', 'audio/x-mpegurl'),
+             'xspf': ('playlist.xspf', 'application/xspf+xml')}
 
 app = flask.Flask(__name__)
 app.config.from_envvar('OBJIDX_GUI_SETTINGS')
-
-app.teardown_appcontext(close_api)
+metrics.instrument(app, 'gui')
 
 
 def up_url(fullurl):
@@ -87,11 +91,30 @@ def show_object(objectid):
     #TODO 200 or 300
     return flask.render_template('object.html', oo=myobj)
 
+def playlist_response(files, kind):
+    """Render files as an M3U or XSPF playlist of presigned URLs
+
+    URLs are signed in bulk, a thousand per API call, not one call per file
+    """
+    template, mimetype = PLAYLISTS[kind]
+    presigned = get_api().get_presigned_many({fo.object['uuid'] for fo in files})
+    entries = [{'title': PurePosixPath(urlparse(fo.info['url']).path).name or fo.info['url'],
+                'location': presigned[fo.object['uuid']],
+                'mime': fo.object.get('mime')}
+               for fo in files if presigned.get(fo.object['uuid'])]
+    return flask.Response(flask.render_template(template, entries=entries),
+                          mimetype=mimetype,
+                          headers={'Content-Disposition': f'attachment; filename="{template}"'})
+
 @app.route("/file/")
 def search_files():
-    """List of files or redirect randomly"""
-    playlist = (flask.request.args.get('playlist', 'off') == 'on')
-    random = (flask.request.args.get('playlist', 'off') == 'on')
+    """List of files, playlist of them or redirect randomly"""
+    playlist = flask.request.args.get('playlist', 'off')
+    if playlist == 'on':
+        playlist = 'm3u'
+    playlist = None if playlist == 'off' else playlist
+    assert playlist is None or playlist in PLAYLISTS
+    pick_random = (flask.request.args.get('random', 'off') == 'on')
     url = flask.request.args.get('url')
     extra = None
     if flask.request.args.get('extrak'):
@@ -103,20 +126,28 @@ def search_files():
     if uuid:
         assert not extra
         assert not url
-        assert not random
+        assert not pick_random
         assert not playlist
         # TODO consider 308
         return flask.redirect(flask.url_for('show_file', fileid=uuid), 301)
     assert url or extra
     assert not (url and extra)
     objidx = get_api()
-    result_list = objidx.search_files({'url': url, 'extra': extra})
-    if random and result_list:
-        assert not playlist
-        return flask.redirect(flask.url_for('show_file', fileid=random.choice(result_list).uuid))
+    assert not (pick_random and playlist)
+    search = {'url': url, 'extra': extra}
+    # NOTE random and playlists go over every match, not just the first (oldest) page
+    if pick_random:
+        uuids = [fo['uuid'] for fo in objidx.stream_files(search, ['uuid'])]
+        if uuids:
+            return flask.redirect(flask.url_for('show_file', fileid=random.choice(uuids)))
     if playlist:
-        assert False
-        # TODO return playlist
+        files = objidx.search_files({**search, 'fields': PLAYLIST_FIELDS},
+                                    app.config.get('OBJIDX_PLAYLIST_SIZE', 500))
+        return playlist_response(list(files), playlist)
+    result_list, next_cursor = objidx.search_files_page(
+        {**search, 'fields': LIST_FIELDS},
+        flask.request.args.get('cursor'),
+        app.config.get('OBJIDX_PAGE_SIZE', 200))
     up_star = None
     param = None
     if url:
@@ -124,7 +155,13 @@ def search_files():
         param = url
     if extra:
         param = extra
-    return flask.render_template('list.html', fos=result_list, up=up_star, param=param)
+    next_args = None
+    if next_cursor:
+        next_args = dict(flask.request.args, cursor=next_cursor)
+    search_args = {key: value for key, value in flask.request.args.items()
+                   if key not in ('cursor', 'random', 'playlist')}
+    return flask.render_template('list.html', fos=result_list, up=up_star, param=param,
+                                 next=next_args, search=search_args)
 
 
 @app.route("/object/")
@@ -0,0 +1,95 @@
+"""Local cache of file checksums
+
+Keyed by stat identity (device, inode) and invalidated when size or mtime change,
+so a re-run over already hashed files only costs a stat() each.
+"""
+
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS checksum (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    checksum BLOB NOT NULL,
+    seen REAL NOT NULL,
+    PRIMARY KEY (dev, ino)
+)"""
+
+def default_path() -> pathlib.Path:
+    """Location of the cache file, honouring XDG_CACHE_HOME"""
+    base = os.environ.get('XDG_CACHE_HOME') or pathlib.Path.home().joinpath('.cache')
+    return pathlib.Path(base).joinpath('objidx', 'checksums.sqlite')
+
+
+class ChecksumCache:
+    """SQLite backed checksum cache, safe to share between hashing threads"""
+    def __init__(self, path: pathlib.Path = None):
+        self.path = pathlib.Path(path) if path else default_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(SCHEMA)
+
+    def get(self, file_stat: os.stat_result) -> bytes:
+        """Return cached checksum for a stat result if still valid, else None"""
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime_ns, checksum FROM checksum "
+                                    "WHERE dev = ? AND ino = ?",
+                                    (file_stat.st_dev, file_stat.st_ino)).fetchone()
+        if not row:
+            return None
+        if row[0] != file_stat.st_size or row[1] != file_stat.st_mtime_ns:
+            return None
+        return row[2]
+
+    def put(self, file_path: pathlib.Path, file_stat: os.stat_result, checksum: bytes):
+        """Remember the checksum for a file"""
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO checksum VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (file_stat.st_dev, file_stat.st_ino, file_stat.st_size,
+                               file_stat.st_mtime_ns, str(pathlib.Path(file_path).absolute()),
+                               checksum, time.time()))
+
+    def prune(self, max_age: float = None) -> int:
+        """Drop entries whose file is gone or changed, or older than max_age seconds
+
+        Returns number of entries removed; the database file is compacted afterwards
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT dev, ino, size, mtime_ns, path, seen "
+                                     "FROM checksum").fetchall()
+        stale = []
+        now = time.time()
+        for dev, ino, size, mtime_ns, path, seen in rows:
+            if max_age is not None and now - seen > max_age:
+                stale.append((dev, ino))
+                continue
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                stale.append((dev, ino))
+                continue
+            if (file_stat.st_dev, file_stat.st_ino, file_stat.st_size,
+                    file_stat.st_mtime_ns) != (dev, ino, size, mtime_ns):
+                stale.append((dev, ino))
+        with self.lock:
+            self.conn.executemany("DELETE FROM checksum WHERE dev = ? AND ino = ?", stale)
+            self.conn.execute("VACUUM")
+        return len(stale)
+
+    def clear(self):
+        """Forget everything"""
+        with self.lock:
+            self.conn.execute("DELETE FROM checksum")
+            self.conn.execute("VACUUM")
+
+    def close(self):
+        """Close the underlying database"""
+        self.conn.close()
@@ -0,0 +1,52 @@
+"""Small thread safe LRU cache with optional expiry, for API and client lookups"""
+
+import collections
+import threading
+import time
+
+
+class LRUCache:
+    """Mapping of at most maxsize entries, least recently used dropped first
+
+    With a ttl (seconds) entries also expire; maxsize 0 disables the cache
+    """
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the entry for key, or default if missing or expired"""
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires is not None and expires < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Add or replace the entry for key"""
+        if not self.maxsize:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def prune(self, predicate):
+        """Drop all entries for which predicate(key, value) is true"""
+        with self.lock:
+            for key in [key for key, (_, value) in self.entries.items() if predicate(key, value)]:
+                del self.entries[key]
+
+    def clear(self):
+        """Drop everything"""
+        with self.lock:
+            self.entries.clear()
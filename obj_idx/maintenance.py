@@ -0,0 +1,247 @@
+"""Index and S3 upkeep run from obj-idx-admin
+
+Works on the database directly, so needs OBJIDX_SETTINGS like the API
+"""
+
+import datetime
+import hashlib
+import time
+from . import db, multipart, s3lib
+
+app = db.app
+db = db.db
+
+RECONCILE_BATCH = 1000
+SCRUB_BATCH = 100
+SCRUB_CHUNK = 1048576
+
+
+def s3_client():
+    """Shared S3 client for the configured endpoint"""
+    return s3lib.s3_client(app.config['OBJIDX_S3'], app.config.get('OBJIDX_S3_POOL'))
+
+def abort_stale_multipart(older_than: datetime.timedelta, dry_run: bool = False) -> list:
+    """Abort multipart uploads with no progress for older_than, in S3 and the index
+
+    Their objects are marked deleted so the next upload of the file starts over
+    rather than getting a conflict. Returns the objects handled.
+    """
+    cutoff = datetime.datetime.utcnow() - older_than
+    stale = (db.Object.query
+             .filter(db.Object.mpu_id.isnot(None), db.Object.mpu_time < cutoff)
+             .filter_by(completed=False)
+             .order_by(db.Object.mpu_time)
+             .all())
+    if dry_run:
+        return stale
+    client = s3_client()
+    for myobj in stale:
+        multipart.abort(client, myobj.bucket, myobj.key, myobj.mpu_id)
+        db.Part.query.filter_by(obj_uuid=myobj.uuid).delete()
+        myobj.mpu_id = None
+        myobj.mpu_part_size = None
+        myobj.mpu_time = None
+        myobj.deleted = True
+        # NOTE commit each so an interruption never leaves S3 and the index out of step
+        db.session.commit()
+    return stale
+
+def abort_orphan_multipart(older_than: datetime.timedelta, dry_run: bool = False) -> list:
+    """Abort multipart uploads in the configured buckets the index does not know about
+
+    Such as ones left by a client that died before recording them.
+    Returns (bucket, key, upload ID) of each.
+    """
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - older_than
+    known = {mpu_id for (mpu_id, ) in
+             db.session.query(db.Object.mpu_id).filter(db.Object.mpu_id.isnot(None))}
+    client = s3_client()
+    orphans = []
+    paginator = client.get_paginator('list_multipart_uploads')
+    for bucket in app.config['OBJIDX_BUCKETS']:
+        for page in paginator.paginate(Bucket=bucket):
+            for upload in page.get('Uploads', []):
+                if upload['UploadId'] not in known and upload['Initiated'] < cutoff:
+                    orphans.append((bucket, upload['Key'], upload['UploadId']))
+    if not dry_run:
+        for bucket, key, upload_id in orphans:
+            multipart.abort(client, bucket, key, upload_id)
+    return orphans
+
+def sweep_expired(grace: datetime.timedelta = datetime.timedelta(0),
+                  dry_run: bool = False) -> list:
+    """Give up on uploads whose lease ran out more than grace ago
+
+    Their multipart upload, if any, is aborted and the object marked deleted so
+    nothing is left half done. An uploader renewing in the meantime keeps its
+    object: each is only swept if its lease is still the expired one.
+    Returns the objects swept.
+    """
+    cutoff = datetime.datetime.utcnow() - grace
+    expired = (db.Object.query
+               .filter(db.Object.lease_expires < cutoff)
+               .filter_by(completed=False, deleted=False)
+               .order_by(db.Object.lease_expires)
+               .all())
+    if dry_run:
+        return expired
+    client = s3_client()
+    table = db.Object.__table__
+    swept = []
+    for myobj in expired:
+        mpu_id = myobj.mpu_id
+        if not db.session.execute(table.update()
+                                  .where(table.c.uuid == myobj.uuid)
+                                  .where(table.c.lease_id == myobj.lease_id)
+                                  .where(table.c.lease_expires < cutoff)
+                                  .where(~table.c.completed & ~table.c.deleted)
+                                  .values(deleted=True, mpu_id=None,
+                                          mpu_part_size=None, mpu_time=None)).rowcount:
+            db.session.rollback()
+            continue
+        db.Part.query.filter_by(obj_uuid=myobj.uuid).delete()
+        db.session.commit()
+        # NOTE after the commit; if this fails abort-multipart --orphans gets it later
+        if mpu_id:
+            multipart.abort(client, myobj.bucket, myobj.key, mpu_id)
+        swept.append(myobj)
+    return swept
+
+def _index_keys(bucket: str, batch: int):
+    """Objects of a bucket in key byte order, read batch rows at a time via buckey"""
+    key = db.Object.key.collate('C')
+    last = None
+    while True:
+        query = (db.session.query(db.Object.uuid, db.Object.key, db.Object.obj_size,
+                                  db.Object.completed, db.Object.deleted)
+                 .filter(db.Object.bucket == bucket))
+        if last is not None:
+            query = query.filter(key > last)
+        rows = query.order_by(key).limit(batch).all()
+        yield from rows
+        if len(rows) < batch:
+            return
+        last = rows[-1].key
+
+def _s3_keys(client, bucket: str):
+    """(key, size) of everything in a bucket, in the byte order S3 lists them"""
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket):
+        for item in page.get('Contents', []):
+            yield item['Key'], item['Size']
+
+def _mark_incomplete(obj_uuids: list):
+    """Mark objects not completed so the next upload of the file replaces them"""
+    (db.Object.query.filter(db.Object.uuid.in_(obj_uuids))
+     .update({'completed': False}, synchronize_session=False))
+    db.session.commit()
+
+def reconcile(bucket: str, repair: bool = False, batch: int = RECONCILE_BATCH):
+    """Compare a bucket listing with the index, yielding (problem, key, row, S3 size)
+
+    Problems are 'missing' (completed in the index but not in S3), 'size' (S3
+    size differs), 'orphan' (in S3 but not the index), 'staging' (an orphan
+    under the staging prefix, maybe an upload in flight), 'deleted' (in S3
+    though deleted in the index) and 'unfinished' (in S3 but never marked
+    completed). With repair, missing and size mismatched objects are marked not
+    completed, so the next upload of their file sends them again.
+
+    Both sides are walked in key order and merged, so memory use stays constant
+    however many keys there are, and S3 sees one request per thousand keys.
+    """
+    listing = _s3_keys(s3_client(), bucket)
+    rows = _index_keys(bucket, batch)
+    item = next(listing, None)
+    row = next(rows, None)
+    broken = []
+    while item or row:
+        if row is None or (item and item[0] < row.key):
+            key, size = item
+            yield ('staging' if key.startswith(s3lib.STAGING_PREFIX) else 'orphan'), key, None, size
+            item = next(listing, None)
+            continue
+        if item is None or row.key < item[0]:
+            if row.completed and not row.deleted:
+                broken.append(row.uuid)
+                yield 'missing', row.key, row, None
+        elif row.deleted:
+            yield 'deleted', row.key, row, item[1]
+        elif not row.completed:
+            yield 'unfinished', row.key, row, item[1]
+        elif row.obj_size != item[1]:
+            broken.append(row.uuid)
+            yield 'size', row.key, row, item[1]
+        if item and row.key == item[0]:
+            item = next(listing, None)
+        row = next(rows, None)
+        if repair and len(broken) >= batch:
+            _mark_incomplete(broken)
+            broken = []
+    if repair and broken:
+        _mark_incomplete(broken)
+
+
+class Throttle:
+    """Sleep as needed to average at most rate bytes and iops reads per second"""
+    def __init__(self, rate: float = None, iops: float = None):
+        self.rate = rate
+        self.iops = iops
+        self.start = time.monotonic()
+        self.bytes = 0
+        self.ops = 0
+
+    def __call__(self, nbytes: int):
+        """Account for one read of nbytes, waiting first if over either limit"""
+        self.bytes += nbytes
+        self.ops += 1
+        due = max(self.bytes / self.rate if self.rate else 0,
+                  self.ops / self.iops if self.iops else 0)
+        ahead = due - (time.monotonic() - self.start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+def verify_object(client, myobj, throttle: Throttle, chunk_size: int = SCRUB_CHUNK) -> bool:
+    """Stream an object from S3 and check it against its checksum and size"""
+    check = hashlib.sha256()
+    size = 0
+    try:
+        body = client.get_object(Bucket=myobj.bucket, Key=myobj.key)['Body']
+    except client.exceptions.NoSuchKey:
+        return False
+    throttle(0)
+    for chunk in body.iter_chunks(chunk_size):
+        throttle(len(chunk))
+        check.update(chunk)
+        size += len(chunk)
+    return size == myobj.obj_size and check.digest() == myobj.checksum
+
+def scrub(older_than: datetime.timedelta,
+          rate: float = None,
+          iops: float = None,
+          limit: int = None,
+          chunk_size: int = SCRUB_CHUNK):
+    """Re-read completed objects not verified within older_than, yielding (object, ok)
+
+    Never verified objects go first, then the longest ago. Each result is
+    committed as it comes, so the index itself is the checkpoint: a scrub that
+    is stopped picks up where it left off next time. rate (bytes per second)
+    and iops cap the reading so uploads are not starved.
+    """
+    cutoff = datetime.datetime.utcnow() - older_than
+    client = s3_client()
+    throttle = Throttle(rate, iops)
+    done = 0
+    while limit is None or done < limit:
+        batch = (db.Object.query
+                 .filter(db.or_(db.Object.verified.is_(None), db.Object.verified < cutoff))
+                 .filter_by(completed=True, deleted=False)
+                 .order_by(db.Object.verified.asc().nulls_first(), db.Object.uuid)
+                 .limit(SCRUB_BATCH if limit is None else min(SCRUB_BATCH, limit - done))
+                 .all())
+        if not batch:
+            break
+        for myobj in batch:
+            myobj.verify_ok = verify_object(client, myobj, throttle, chunk_size)
+            myobj.verified = datetime.datetime.utcnow()
+            db.session.commit()
+            done += 1
+            yield myobj, myobj.verify_ok
@@ -0,0 +1,172 @@
+"""Prometheus metrics kept in process and served in the text exposition format
+
+No client library or push gateway needed; each process counts for itself, so
+with several worker processes every one answers /metrics with its own share
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+import flask
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra='') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """Base of a named metric with a fixed list of label names"""
+    kind = 'untyped'
+
+    def __init__(self, name: str, doc: str, labels=(), registry=REGISTRY):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def samples(self):
+        """(name suffix, label string, value) of every sample"""
+        with self.lock:
+            return [('', _labels(self.labels, key), value) for key, value in self.values.items()]
+
+    def render(self) -> str:
+        """The metric in the text exposition format"""
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{self.name}{suffix}{labels} {value}"
+                     for suffix, labels, value in self.samples())
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """Count of events that only goes up"""
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        """Count amount more for the given label values"""
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Value read when scraped, from func() returning a number or {label values: number}"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, doc: str, func, labels=(), registry=REGISTRY):
+        super().__init__(name, doc, labels, registry)
+        self.func = func
+
+    def samples(self):
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [('', _labels(self.labels, key), value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    """Distribution of observed values, typically seconds taken"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, doc: str, labels=(), buckets=BUCKETS, registry=REGISTRY):
+        super().__init__(name, doc, labels, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        """Record one value for the given label values"""
+        with self.lock:
+            counts, total = self.values.get(labels, ([0] * (len(self.buckets) + 1), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[labels] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        """Observe the seconds the with block takes"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        samples = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf', ), counts):
+                cumulative += count
+                samples.append(('_bucket', _labels(self.labels, key, f'le="{bound}"'), cumulative))
+            samples.append(('_sum', _labels(self.labels, key), total))
+            samples.append(('_count', _labels(self.labels, key), cumulative))
+        return samples
+
+
+def render(registry=REGISTRY) -> str:
+    """All metrics of a registry in the text exposition format"""
+    return ''.join(metric.render() for metric in registry)
+
+
+REQUEST_SECONDS = Histogram('objidx_http_request_duration_seconds',
+                            'Time to answer HTTP requests', ('app', 'namespace', 'method'))
+RESPONSES = Counter('objidx_http_responses_total',
+                    'HTTP responses sent', ('app', 'namespace', 'status'))
+
+def namespace() -> str:
+    """First path segment of the matched route, like file or upload"""
+    rule = flask.request.url_rule
+    if rule is None:
+        return 'unmatched'
+    return rule.rule.strip('/').partition('/')[0] or 'root'
+
+def instrument(app: flask.Flask, name: str) -> bool:
+    """Time every request of a Flask app and serve GET /metrics, unless OBJIDX_METRICS is off
+
+    Returns whether it did
+    """
+    if not app.config.get('OBJIDX_METRICS', True):
+        return False
+    @app.before_request
+    def start_timer():
+        flask.g.metrics_start = time.perf_counter()
+    @app.after_request
+    def record(response):
+        start = flask.g.pop('metrics_start', None)
+        if start is not None:
+            REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                    name, namespace(), flask.request.method)
+            RESPONSES.inc(name, namespace(), response.status_code)
+        return response
+    def metrics():
+        return flask.Response(render(), content_type=CONTENT_TYPE)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    return True
+
+def instrument_sqlalchemy():
+    """Time every SQL statement run by any SQLAlchemy engine in this process"""
+    # NOTE imported here so the GUI does not need SQLAlchemy
+    import sqlalchemy  # pylint: disable=import-outside-toplevel
+    query_seconds = Histogram('objidx_db_query_duration_seconds',
+                              'Time to run SQL statements', ('statement', ))
+    @sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'before_cursor_execute')
+    def start_query(conn, *_):
+        conn.info['metrics_start'] = time.perf_counter()
+    @sqlalchemy.event.listens_for(sqlalchemy.engine.Engine, 'after_cursor_execute')
+    def end_query(conn, _, statement, *__):
+        start = conn.info.pop('metrics_start', None)
+        if start is not None:
+            query_seconds.observe(time.perf_counter() - start,
+                                  statement.lstrip().partition(' ')[0].upper())
+    return query_seconds
@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 
-"""CLI for minio admin tools"""
+"""CLI for minio admin tools and index maintenance"""
 
 import argparse
+import collections
 import pathlib
 import os
 import tempfile
 import json
 import secrets
 import datetime
+import time
 import minio
 
 
@@ -75,7 +77,15 @@ class MinIO:
         """Add a user"""
         self.mioa.user_add(username, password)
 
-def _setup(mioo, args):
+def _minio(args) -> MinIO:
+    return MinIO(args.alias,
+                 args.endpoint,
+                 os.environ['MINIO_ROOT_USER'],
+                 os.environ['MINIO_ROOT_PASSWORD'],
+                 mc_path=args.mc_path)
+
+def _setup(args):
+    mioo = _minio(args)
     password = secrets.token_urlsafe()
     print(f"Password: {password}")
     mioo.add_user(args.username, password)
@@ -83,6 +93,50 @@ def _setup(mioo, args):
     for bucket in args.buckets:
         mioo.bucket_with_users(f"{bucket}-{today}", [args.username])
 
+def _abort_multipart(args):
+    # NOTE imported here as it connects to the database per OBJIDX_SETTINGS
+    from . import maintenance  # pylint: disable=import-outside-toplevel
+    older_than = datetime.timedelta(hours=args.older_than)
+    for myobj in maintenance.abort_stale_multipart(older_than, args.pretend):
+        print('stale', myobj.uuid, myobj.bucket, myobj.key, myobj.mpu_id, myobj.mpu_time)
+    if args.orphans:
+        for bucket, key, upload_id in maintenance.abort_orphan_multipart(older_than, args.pretend):
+            print('orphan', bucket, key, upload_id)
+
+def _sweep(args):
+    from . import maintenance  # pylint: disable=import-outside-toplevel
+    grace = datetime.timedelta(seconds=args.grace)
+    while True:
+        for myobj in maintenance.sweep_expired(grace, args.pretend):
+            print('expired', myobj.uuid, myobj.bucket, myobj.key, myobj.mpu_id, myobj.lease_expires)
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+def _reconcile(args):
+    from . import maintenance  # pylint: disable=import-outside-toplevel
+    problems = collections.Counter()
+    for bucket in args.buckets or maintenance.app.config['OBJIDX_BUCKETS']:
+        for problem, key, row, size in maintenance.reconcile(bucket, args.repair):
+            problems[problem] += 1
+            print(problem, bucket, key, row.uuid if row else None,
+                  row.obj_size if row else None, size)
+    print(dict(problems))
+
+def _scrub(args):
+    from . import maintenance  # pylint: disable=import-outside-toplevel
+    results = collections.Counter()
+    for myobj, ok in maintenance.scrub(datetime.timedelta(days=args.older_than),
+                                       args.mbps * 1048576 if args.mbps else None,
+                                       args.iops,
+                                       args.limit):
+        results['ok' if ok else 'bad'] += 1
+        if not ok or args.verbose:
+            print('ok' if ok else 'BAD', myobj.uuid, myobj.bucket, myobj.key)
+    print(dict(results))
+    if results['bad']:
+        raise SystemExit(1)
+
 def cli():
     """CLI main function"""
     parser = argparse.ArgumentParser(description="Object Index MinIO admin")
@@ -94,13 +148,38 @@ def cli():
     parser_setup.add_argument('username')
     parser_setup.add_argument('buckets', nargs='+')
     parser_setup.set_defaults(func=_setup)
+    parser_abort = subparsers.add_parser('abort-multipart',
+                                         help="abort multipart uploads that stopped making progress")
+    parser_abort.add_argument('--older-than', type=float, default=24, help="HOURS")
+    parser_abort.add_argument('--orphans', action='store_true',
+                              help="also abort ones in S3 the index does not know about")
+    parser_abort.add_argument('-p', '--pretend', action='store_true')
+    parser_abort.set_defaults(func=_abort_multipart)
+    parser_sweep = subparsers.add_parser('sweep',
+                                         help="give up on uploads whose lease expired")
+    parser_sweep.add_argument('--grace', type=float, default=0,
+                              help="SECONDS past expiry to wait")
+    parser_sweep.add_argument('--interval', type=float,
+                              help="keep running, sweeping every SECONDS")
+    parser_sweep.add_argument('-p', '--pretend', action='store_true')
+    parser_sweep.set_defaults(func=_sweep)
+    parser_reconcile = subparsers.add_parser('reconcile',
+                                             help="compare bucket contents with the index")
+    parser_reconcile.add_argument('--repair', action='store_true',
+                                  help="mark missing and wrong sized objects not completed")
+    parser_reconcile.add_argument('buckets', nargs='*', help="default OBJIDX_BUCKETS")
+    parser_reconcile.set_defaults(func=_reconcile)
+    parser_scrub = subparsers.add_parser('scrub',
+                                         help="re-read stored objects and check their SHA-256")
+    parser_scrub.add_argument('--older-than', type=float, default=90,
+                              help="DAYS since an object was last verified")
+    parser_scrub.add_argument('--mbps', type=float, default=5, help="MiB/s read cap, 0 for none")
+    parser_scrub.add_argument('--iops', type=float, default=50, help="reads per second cap, 0 for none")
+    parser_scrub.add_argument('--limit', type=int, help="stop after this many objects")
+    parser_scrub.add_argument('-v', '--verbose', action='store_true', help="print good ones too")
+    parser_scrub.set_defaults(func=_scrub)
     args = parser.parse_args()
-    args.func(MinIO(args.alias,
-                    args.endpoint,
-                    os.environ['MINIO_ROOT_USER'],
-                    os.environ['MINIO_ROOT_PASSWORD'],
-                    mc_path=args.mc_path),
-              args)
+    args.func(args)
 
 
 if __name__ == '__main__':
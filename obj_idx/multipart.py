@@ -0,0 +1,66 @@
+"""Resumable S3 multipart uploads, with progress kept in the index
+
+The upload ID and every finished part are recorded in ObjectIndex as they
+happen, so if the client dies the next upload of the same file (registered with
+resume) skips the parts already sent instead of starting from byte zero.
+"""
+
+import concurrent.futures
+import os
+from . import clilib, s3lib
+
+MAX_PARTS = 10000
+
+
+def part_size_for(size: int, chunksize: int) -> int:
+    """Part size for a file of size bytes, staying under the S3 part count limit"""
+    return max(chunksize, -(-size // MAX_PARTS))
+
+def upload_file(fileobj: clilib.File, filename: str, jobs: int = 1, chunksize: int = 8388608):
+    """Upload filename as fileobj's object in parts, resuming fileobj.multipart if set
+
+    Does not mark the upload finished; call fileobj.finish_upload() after
+    """
+    s3_url = fileobj.get_s3_url()
+    obj_uuid = fileobj.info['file_object']['uuid']
+    s3_client = s3lib.s3_client(s3_url['server'], max(jobs, s3lib.MAX_POOL_CONNECTIONS))
+    size = os.path.getsize(filename)
+    if fileobj.multipart and fileobj.multipart.get('upload_id'):
+        upload_id = fileobj.multipart['upload_id']
+        part_size = fileobj.multipart['part_size']
+        etags = {part['number']: part['etag'] for part in fileobj.multipart['parts']}
+    else:
+        part_size = part_size_for(size, chunksize)
+        upload_id = s3_client.create_multipart_upload(Bucket=s3_url['bucket'],
+                                                      Key=s3_url['key'])['UploadId']
+        fileobj.oio.start_multipart(obj_uuid, upload_id, part_size)
+        etags = {}
+    def send(number):
+        with open(filename, 'rb') as file_obj:
+            file_obj.seek((number - 1) * part_size)
+            data = file_obj.read(part_size)
+        etag = s3_client.upload_part(Bucket=s3_url['bucket'],
+                                     Key=s3_url['key'],
+                                     UploadId=upload_id,
+                                     PartNumber=number,
+                                     Body=data)['ETag']
+        fileobj.oio.put_part(obj_uuid, upload_id, number, etag, len(data))
+        return number, etag
+    todo = [number for number in range(1, max(1, -(-size // part_size)) + 1)
+            if number not in etags]
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        etags.update(pool.map(send, todo))
+    s3_client.complete_multipart_upload(
+        Bucket=s3_url['bucket'],
+        Key=s3_url['key'],
+        UploadId=upload_id,
+        MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': etags[number]}
+                                   for number in sorted(etags)]})
+
+def abort(s3_client, bucket: str, key: str, upload_id: str) -> bool:
+    """Abort a multipart upload in S3; False if S3 no longer knows it"""
+    try:
+        s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+    except s3_client.exceptions.NoSuchUpload:
+        return False
+    return True
@@ -3,19 +3,34 @@
 Handle some of oddness of using an on-prem solution
 """
 
+import threading
 import urllib.parse
 import boto3
+import boto3.s3.transfer
 
-def get_s3_service(endpoint, key):
+MAX_POOL_CONNECTIONS = 10
+STAGING_PREFIX = "staging/"
+
+_lock = threading.Lock()
+_clients = {}
+_local = threading.local()
+_transfer = {}
+
+def _config(max_pool_connections=None):
+    return boto3.session.Config(signature_version='s3v4',
+                                max_pool_connections=max_pool_connections or MAX_POOL_CONNECTIONS)
+
+def get_s3_service(endpoint, key, max_pool_connections=None):
     """Returns a boto3 S3 Service Resource
 
     https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#service-resource
     """
-    return boto3.resource('s3',
-                          endpoint_url=endpoint,
-                          aws_access_key_id=key[0],
-                          aws_secret_access_key=key[1],
-                          config=boto3.session.Config(signature_version='s3v4'))
+    # NOTE own session each time; the default boto3 session is not safe to share between threads
+    return boto3.session.Session().resource('s3',
+                                            endpoint_url=endpoint,
+                                            aws_access_key_id=key[0],
+                                            aws_secret_access_key=key[1],
+                                            config=_config(max_pool_connections))
 
 def url2epcred(url):
     """Returns a tuple with endpoint and key tuple based on pseudo-url
@@ -39,14 +54,53 @@ def get_s3_service_url(url):
     """Returns a boto S3 Service Resource using a pseudo URL"""
     return get_s3_service(*url2epcred(url))
 
-def get_s3_client_low(url):
+def get_s3_client_low(url, max_pool_connections=None):
     """Low level S3 client"""
     endpoint, key = url2epcred(url)
-    return boto3.client('s3',
-                        endpoint_url=endpoint,
-                        aws_access_key_id=key[0],
-                        aws_secret_access_key=key[1],
-                        config=boto3.session.Config(signature_version='s3v4'))
+    return boto3.session.Session().client('s3',
+                                          endpoint_url=endpoint,
+                                          aws_access_key_id=key[0],
+                                          aws_secret_access_key=key[1],
+                                          config=_config(max_pool_connections))
+
+def s3_client(url, max_pool_connections=None):
+    """Shared low level S3 client for a pseudo URL
+
+    Clients are thread safe, so there is one per endpoint for the whole process
+    and its HTTP connections are reused.
+    """
+    with _lock:
+        if url not in _clients:
+            _clients[url] = get_s3_client_low(url, max_pool_connections)
+        return _clients[url]
+
+def s3_service(url):
+    """S3 Service Resource for a pseudo URL, cached per thread
+
+    Resources are not thread safe so each thread keeps its own, sized for the
+    configured transfer concurrency.
+    """
+    if not hasattr(_local, 'services'):
+        _local.services = {}
+    if url not in _local.services:
+        concurrency = _transfer.get('max_concurrency') or 0
+        _local.services[url] = get_s3_service(*url2epcred(url),
+                                              max(concurrency, MAX_POOL_CONNECTIONS))
+    return _local.services[url]
+
+def configure_transfer(multipart_threshold=None, multipart_chunksize=None, max_concurrency=None):
+    """Set managed transfer options used by transfer_config(); None keeps the boto3 default"""
+    _transfer.clear()
+    if multipart_threshold:
+        _transfer['multipart_threshold'] = multipart_threshold
+    if multipart_chunksize:
+        _transfer['multipart_chunksize'] = multipart_chunksize
+    if max_concurrency:
+        _transfer['max_concurrency'] = max_concurrency
+
+def transfer_config():
+    """boto3 TransferConfig as set by configure_transfer()"""
+    return boto3.s3.transfer.TransferConfig(**_transfer)
 
 def presigned(s3_obj, bucket, key, method="get", expires=3600):
     """Given an S3 object, a bucket, and a key, generate a presigned URL for that"""
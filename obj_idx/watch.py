@@ -0,0 +1,99 @@
+"""Continuous ingestion of files landing in a directory tree, using inotify
+
+A file is picked up once it has been closed after writing, or moved in, and
+then left alone for settle seconds, so files written in several goes are only
+uploaded once they are done. New subdirectories are watched as they appear.
+"""
+
+import os
+import time
+import warnings
+from . import client, inotify
+
+SETTLE = 2.0
+MASK = (inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO | inotify.IN_MODIFY |
+        inotify.IN_CREATE | inotify.IN_DELETE_SELF)
+# NOTE downloaders write these then rename them into place, which we do see
+IGNORE_SUFFIXES = ('.part', '.ytdl', '.tmp', '.temp')
+
+
+def _watch_tree(notify: inotify.Inotify, root: str, pending: dict = None):
+    """Watch root and every directory below it; files found are added to pending if given"""
+    todo = [root]
+    while todo:
+        directory = todo.pop()
+        notify.add_watch(directory, MASK)
+        # NOTE listed after adding the watch so nothing written in between is missed
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    todo.append(entry.path)
+                elif pending is not None and entry.is_file(follow_symlinks=False):
+                    pending[entry.path] = time.monotonic()
+
+def plain_jobs(bucket: str, extra: dict = None):
+    """make_job for watch_jobs uploading every file as is"""
+    def make_job(path, _):
+        return client.UploadJob(path, bucket, extra=extra)
+    return make_job
+
+def ytdl_jobs(bucket: str, partial: bool = False, library: str = None):
+    """make_job for watch_jobs pairing yt-dlp media files with their .info.json
+
+    Whichever of the two settles last makes the job; anything without a
+    sidecar naming it, like thumbnails or format fragments, is left alone
+    """
+    def make_job(path, pending):
+        if path.endswith('.info.json'):
+            sidecar = path
+        else:
+            sidecar = os.path.splitext(path)[0] + '.info.json'
+            if sidecar in pending or not os.path.exists(sidecar):
+                return None
+        metadata, media_file = client.info_json_media(sidecar)
+        if not metadata or media_file in pending or not os.path.isfile(media_file):
+            return None
+        if path != sidecar and path != media_file:
+            return None
+        return client.ytdl_job(metadata, media_file, bucket, partial, library)
+    return make_job
+
+def watch_jobs(root: str, make_job, settle: float = SETTLE, existing: bool = False):
+    """UploadJobs for files as they land under root, until root goes away
+
+    make_job(path, pending) returns an UploadJob or None for a settled file;
+    pending holds the paths still settling. With existing, files already
+    there are taken too.
+    """
+    pending = {}
+    with inotify.Inotify() as notify:
+        _watch_tree(notify, root, pending if existing else None)
+        while notify.watches:
+            timeout = None
+            if pending:
+                timeout = max(0, min(pending.values()) + settle - time.monotonic())
+            for directory, mask, name in notify.read(timeout):
+                if directory is None:
+                    warnings.warn("inotify queue overflowed; run sync to pick up missed files")
+                    continue
+                path = os.path.join(directory, name)
+                if mask & inotify.IN_ISDIR:
+                    if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                        _watch_tree(notify, path, pending)
+                elif mask & (inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO):
+                    pending[path] = time.monotonic()
+                elif mask & inotify.IN_MODIFY and path in pending:
+                    pending[path] = time.monotonic()  # being written again
+            now = time.monotonic()
+            for path in [path for path, since in pending.items() if now - since >= settle]:
+                del pending[path]
+                if path.endswith(IGNORE_SUFFIXES) or not os.path.isfile(path):
+                    continue
+                try:
+                    job = make_job(path, pending)
+                except Exception as e:  # pylint: disable=broad-except
+                    # NOTE one odd file, e.g. a half written .info.json, must not stop watching
+                    warnings.warn(f"Skipping {path}: {e!r}")
+                    continue
+                if job:
+                    yield job
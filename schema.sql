@@ -55,12 +55,33 @@ CREATE TABLE public.object (
     mime character varying(255),
     completed boolean NOT NULL,
     deleted boolean NOT NULL,
-    extra jsonb
+    extra jsonb,
+    mpu_id character varying(1023),
+    mpu_part_size bigint,
+    mpu_time timestamp without time zone,
+    lease_id uuid,
+    lease_expires timestamp without time zone,
+    verified timestamp without time zone,
+    verify_ok boolean
 );
 
 
 ALTER TABLE public.object OWNER TO chris;
 
+--
+-- Name: part; Type: TABLE; Schema: public; Owner: chris
+--
+
+CREATE TABLE public.part (
+    obj_uuid uuid NOT NULL,
+    number integer NOT NULL,
+    etag character varying(255) NOT NULL,
+    size bigint NOT NULL
+);
+
+
+ALTER TABLE public.part OWNER TO chris;
+
 --
 -- Name: file file_pkey; Type: CONSTRAINT; Schema: public; Owner: chris
 --
@@ -77,11 +98,33 @@ ALTER TABLE ONLY public.object
     ADD CONSTRAINT object_pkey PRIMARY KEY (uuid);
 
 
+--
+-- Name: part part_pkey; Type: CONSTRAINT; Schema: public; Owner: chris
+--
+
+ALTER TABLE ONLY public.part
+    ADD CONSTRAINT part_pkey PRIMARY KEY (obj_uuid, number);
+
+
 --
 -- Name: buckey; Type: INDEX; Schema: public; Owner: chris
 --
 
-CREATE INDEX buckey ON public.object USING btree (bucket, key);
+CREATE INDEX buckey ON public.object USING btree (bucket, key COLLATE "C");
+
+
+--
+-- Name: ix_file_ctime_uuid; Type: INDEX; Schema: public; Owner: chris
+--
+
+CREATE INDEX ix_file_ctime_uuid ON public.file USING btree (ctime, uuid);
+
+
+--
+-- Name: ix_file_extra; Type: INDEX; Schema: public; Owner: chris
+--
+
+CREATE INDEX ix_file_extra ON public.file USING gin (extra jsonb_path_ops);
 
 
 --
@@ -99,10 +142,45 @@ CREATE INDEX ix_file_url ON public.file USING btree (url);
 
 
 --
--- Name: ix_object_checksum; Type: INDEX; Schema: public; Owner: chris
+-- Name: ix_file_url_c; Type: INDEX; Schema: public; Owner: chris
 --
 
-CREATE INDEX ix_object_checksum ON public.object USING btree (checksum);
+CREATE INDEX ix_file_url_c ON public.file USING btree (url COLLATE "C", uuid);
+
+
+--
+-- Name: ix_object_lease_expires; Type: INDEX; Schema: public; Owner: chris
+--
+
+CREATE INDEX ix_object_lease_expires ON public.object USING btree (lease_expires) WHERE ((NOT completed) AND (NOT deleted));
+
+
+--
+-- Name: ix_object_mpu_time; Type: INDEX; Schema: public; Owner: chris
+--
+
+CREATE INDEX ix_object_mpu_time ON public.object USING btree (mpu_time) WHERE (mpu_id IS NOT NULL);
+
+
+--
+-- Name: ix_object_verified; Type: INDEX; Schema: public; Owner: chris
+--
+
+CREATE INDEX ix_object_verified ON public.object USING btree (verified NULLS FIRST, uuid) WHERE (completed AND (NOT deleted));
+
+
+--
+-- Name: uq_file_url_obj_uuid; Type: INDEX; Schema: public; Owner: chris
+--
+
+CREATE UNIQUE INDEX uq_file_url_obj_uuid ON public.file USING btree (url, obj_uuid);
+
+
+--
+-- Name: uq_object_checksum; Type: INDEX; Schema: public; Owner: chris
+--
+
+CREATE UNIQUE INDEX uq_object_checksum ON public.object USING btree (checksum);
 
 
 --
@@ -113,6 +191,14 @@ ALTER TABLE ONLY public.file
     ADD CONSTRAINT file_obj_uuid_fkey FOREIGN KEY (obj_uuid) REFERENCES public.object(uuid);
 
 
+--
+-- Name: part part_obj_uuid_fkey; Type: FK CONSTRAINT; Schema: public; Owner: chris
+--
+
+ALTER TABLE ONLY public.part
+    ADD CONSTRAINT part_obj_uuid_fkey FOREIGN KEY (obj_uuid) REFERENCES public.object(uuid);
+
+
 --
 -- PostgreSQL database dump complete
 --
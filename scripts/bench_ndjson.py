@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""Benchmark GET /file/ as paged JSON vs streamed NDJSON, plain and compressed
+
+Runs against the API at OBJIDX_URL; pick a URL prefix matching ~100k files
+(e.g. a directory tree of real uploads).
+Reports wall time, bytes on the wire and rows for each mode.
+"""
+
+import argparse
+import gzip
+import os
+import time
+import requests
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def bench_json(session, base, prefix, limit):
+    """Follow X-Next-Cursor pages of the classic marshalled list"""
+    rows = 0
+    wire = 0
+    params = {'url': prefix, 'limit': limit}
+    while True:
+        result = session.get(base + 'file/', params=params,
+                             headers={'Accept': 'application/json', 'Accept-Encoding': 'identity'})
+        result.raise_for_status()
+        wire += len(result.content)
+        rows += len(result.json())
+        cursor = result.headers.get('X-Next-Cursor')
+        if not cursor:
+            return rows, wire
+        params['cursor'] = cursor
+
+def bench_ndjson(session, base, prefix, encoding):
+    """Read one streamed NDJSON response in the given Content-Encoding"""
+    result = session.get(base + 'file/', params={'url': prefix}, stream=True,
+                         headers={'Accept': 'application/x-ndjson', 'Accept-Encoding': encoding})
+    result.raise_for_status()
+    body = b''.join(result.raw.stream(1 << 16, decode_content=False))
+    wire = len(body)
+    got = result.headers.get('Content-Encoding', 'identity')
+    if got == 'gzip':
+        body = gzip.decompress(body)
+    elif got == 'zstd':
+        body = zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    return body.count(b'\n'), wire
+
+def timed(name, func, *args):
+    """Run func and print its timing"""
+    start = time.perf_counter()
+    rows, wire = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{name:14} {rows:8} rows {elapsed:8.3f}s {wire / 1048576:9.2f} MiB "
+          f"{rows / elapsed if elapsed else 0:10.0f} rows/s")
+
+
+def _cli():
+    parser = argparse.ArgumentParser(description="Object Index list serialization benchmark")
+    parser.add_argument('-l', '--limit', type=int, default=10000, help="page size for JSON mode")
+    parser.add_argument('prefix', help="URL prefix search, e.g. file://host/mnt/*")
+    args = parser.parse_args()
+    base = os.environ['OBJIDX_URL']
+    session = requests.Session()
+    timed('json pages', bench_json, session, base, args.prefix, args.limit)
+    timed('ndjson', bench_ndjson, session, base, args.prefix, 'identity')
+    timed('ndjson gzip', bench_ndjson, session, base, args.prefix, 'gzip')
+    if zstandard:
+        timed('ndjson zstd', bench_ndjson, session, base, args.prefix, 'zstd')
+    else:
+        print("ndjson zstd    skipped, zstandard not installed")
+
+
+if __name__ == '__main__':
+    _cli()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+"""Benchmark URL prefix search, plain LIKE vs the C collation index used by the API
+
+Fills a temporary table shaped like file with a few million file:// URLs in the
+database from OBJIDX_SETTINGS, then compares EXPLAIN ANALYZE of both queries.
+Nothing outside the temporary table is touched.
+"""
+
+import argparse
+import json
+from obj_idx import db
+
+SETUP = [
+    "CREATE TEMP TABLE bench_file (uuid uuid NOT NULL, ctime timestamp NOT NULL, "
+    "url varchar(2047) NOT NULL)",
+    "INSERT INTO bench_file SELECT md5(i::text)::uuid, now() - i * interval '1 second', "
+    "'file://host' || (i % 10) || '/mnt/dir' || (i / :per_dir) || '/file_' || i || '.mp4' "
+    "FROM generate_series(1, :rows) i",
+    "CREATE INDEX ON bench_file (url)",
+    "CREATE INDEX ON bench_file (ctime, uuid)",
+    'CREATE INDEX ON bench_file (url COLLATE "C", uuid)',
+    "ANALYZE bench_file",
+]
+
+QUERIES = {
+    'like': "SELECT * FROM bench_file WHERE url LIKE :pattern "
+            "ORDER BY ctime, uuid LIMIT :limit",
+    'c-index': 'SELECT * FROM bench_file WHERE url COLLATE "C" LIKE :pattern '
+               'ORDER BY url COLLATE "C", uuid LIMIT :limit',
+}
+
+
+def plan_nodes(plan):
+    """Flatten node types of an EXPLAIN JSON plan"""
+    nodes = [f"{plan['Node Type']}({plan.get('Index Name', '')})"
+             if plan.get('Index Name') else plan['Node Type']]
+    for child in plan.get('Plans', []):
+        nodes.extend(plan_nodes(child))
+    return nodes
+
+
+def _cli():
+    parser = argparse.ArgumentParser(description="Object Index URL prefix search benchmark")
+    parser.add_argument('-n', '--rows', type=int, default=3000000)
+    parser.add_argument('-d', '--per-dir', type=int, default=500)
+    parser.add_argument('-l', '--limit', type=int, default=1001)
+    parser.add_argument('prefix', nargs='?', default='file://host3/mnt/dir42')
+    args = parser.parse_args()
+    with db.db.engine.connect() as conn:
+        for statement in SETUP:
+            conn.execute(db.db.text(statement), rows=args.rows, per_dir=args.per_dir)
+        pattern = args.prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        for name, query in QUERIES.items():
+            result = conn.execute(db.db.text(f"EXPLAIN (ANALYZE, FORMAT JSON) {query}"),
+                                  pattern=pattern, limit=args.limit).scalar()
+            if isinstance(result, str):
+                result = json.loads(result)
+            print(f"{name:8} {result[0]['Execution Time']:10.3f} ms",
+                  " > ".join(plan_nodes(result[0]['Plan'])))
+
+
+if __name__ == '__main__':
+    _cli()
@@ -5,12 +5,12 @@
 import pathlib
 import string
 import os
+import sys
 import argparse
-import warnings
-from obj_idx import client
+from obj_idx import client, cli
 
-def one_file(objidx, filename, bucket, base_url, pretend=False, library=None, person=None):
-    """upload one file"""
+def one_file(filename, bucket, base_url, pretend=False, library=None, person=None):
+    """Prepare upload job for one file"""
     assert library
     assert person
     path = pathlib.Path(filename)
@@ -19,19 +19,13 @@ def one_file(objidx, filename, bucket, base_url, pretend=False, library=None, pe
     print(filename, url, person, media)
     if pretend:
         return None
-    flob = client.upload_metadata(filename=filename,
-                                  obj_idx=objidx,
-                                  bucket=bucket,
-                                  url=url,
-                                  direct=False,
-                                  library=library,
-                                  person=person,
-                                  media=media)
-    if not flob:
-        warnings.warn(f"Possible conflict for {filename}; upload failed")
-        return None
-    print(flob.uuid)
-    return flob
+    return client.metadata_job(filename=filename,
+                               bucket=bucket,
+                               url=url,
+                               direct=False,
+                               library=library,
+                               person=person,
+                               media=media)
 
 
 def _cli():
@@ -41,13 +35,16 @@ def _cli():
     parser.add_argument('-u', '--base-url', required=True)
     parser.add_argument('-l', '--library', required=True)
     parser.add_argument('-P', '--person')
+    cli.add_pipeline_args(parser)
     parser.add_argument('filename', nargs='+')
     oi_url = os.environ['OBJIDX_URL']
     oi_user = os.environ['OBJIDX_AUTH'].partition(':')[0]
     args = parser.parse_args()
     objidx = client.get_obj_idx(oi_url, oi_user)
-    for filename in args.filename:
-        one_file(objidx, filename, args.bucket, args.base_url, args.pretend, args.library, args.person)
+    jobs = (one_file(filename, args.bucket, args.base_url, args.pretend, args.library, args.person)
+            for filename in args.filename)
+    if cli.run_pipeline(objidx, (job for job in jobs if job), args):
+        sys.exit(1)
 
 
 
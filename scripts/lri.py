@@ -4,11 +4,12 @@
 
 import argparse
 import os
+import sys
 import json
 import pathlib
 import warnings
 import datetime
-from obj_idx import client
+from obj_idx import client, cli
 
 
 def read_info_json(filename):
@@ -17,8 +18,7 @@ def read_info_json(filename):
         parsed_json = json.load(user_file)
     return parsed_json["id"], parsed_json, datetime.datetime.fromisoformat(parsed_json["timestamp"]), parsed_json["models"]
 
-def upload(objidx,
-           metadata,
+def upload(metadata,
            filename,
            bucket,
            mtime=None,
@@ -27,35 +27,28 @@ def upload(objidx,
            person=None,
            media=None,
            base_url=None):
-    """Upload a given file based on JSON metadata"""
+    """Prepare upload job for a given file based on JSON metadata"""
     url = base_url + str(filename)
     print(filename, url, person, media)
     if pretend:
         return None
-    flob = client.upload_metadata(str(filename),
-                                  objidx,
-                                  bucket=bucket,
-                                  url=url,
-                                  direct=False,
-                                  extra={f"{library}-info": metadata},
-                                  mtime=mtime,
-                                  library=library,
-                                  person=person,
-                                  media=media)
-    if not flob:
-        warnings.warn(f"Possible conflict for {filename}; upload failed")
-        return None
-    print(flob.uuid)
-    return flob
+    return client.metadata_job(str(filename),
+                               bucket=bucket,
+                               url=url,
+                               direct=False,
+                               extra={f"{library}-info": metadata},
+                               mtime=mtime,
+                               library=library,
+                               person=person,
+                               media=media)
 
-def do_info_json(objidx,
-                 info_json,
+def do_info_json(info_json,
                  bucket,
                  base_url,
                  pretend=False,
                  library=None,
                  sub_library=None):
-    """Given a .json file, parse it and upload with relevant metadata"""
+    """Given a .json file, parse it and yield upload jobs with relevant metadata"""
     dirid, extra, mtime, persons = read_info_json(info_json)
     pers = "-".join(persons).replace(" ", "")
     media = sub_library + str(dirid)
@@ -63,12 +56,12 @@ def do_info_json(objidx,
     zipf = dirf.with_suffix(".zip")
     did_something = False
     if zipf.is_file():
-        if upload(objidx, extra, zipf, bucket,  mtime, pretend, library, pers, media, base_url):
-            did_something = True
+        did_something = True
+        yield upload(extra, zipf, bucket,  mtime, pretend, library, pers, media, base_url)
     if dirf.is_dir():
         for subf in dirf.iterdir():
-            if upload(objidx, extra, subf, bucket,  mtime, pretend, library, pers, media, base_url):
-                did_something = True
+            did_something = True
+            yield upload(extra, subf, bucket,  mtime, pretend, library, pers, media, base_url)
     if not did_something:
         warnings.warn(f"Skipping nonexistant {media}")
 
@@ -79,13 +72,18 @@ def _cli():
     parser.add_argument('-l', '--library')
     parser.add_argument('-s', '--sub-library')
     parser.add_argument('-u', '--url-base')
+    cli.add_pipeline_args(parser)
     parser.add_argument('filename', nargs='+')
     oi_url = os.environ['OBJIDX_URL']
     oi_user = os.environ['OBJIDX_AUTH'].partition(':')[0]
     args = parser.parse_args()
     objidx = client.get_obj_idx(oi_url, oi_user)
-    for filename in args.filename:
-        do_info_json(objidx, filename, args.bucket, args.url_base, args.pretend, args.library, args.sub_library)
+    jobs = (job
+            for filename in args.filename
+            for job in do_info_json(filename, args.bucket, args.url_base, args.pretend,
+                                    args.library, args.sub_library))
+    if cli.run_pipeline(objidx, (job for job in jobs if job), args):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -5,15 +5,16 @@
 import datetime
 import argparse
 import os
+import sys
 import json
 import string
-from obj_idx import client
+from obj_idx import client, cli
 
 LIBRARY = 'VSI'
 
 
-def upload(objidx, metadata, bucket, base_url, pretend=False):
-    """Upload a given file based on JSON metadata"""
+def upload(metadata, bucket, base_url, pretend=False):
+    """Prepare upload job for a given file based on JSON metadata"""
     filename = metadata['siteName'] + ' ' + metadata['videoName'] + '.mp4'
     qualmod = ''
     if not metadata['versionHigh']:
@@ -29,23 +30,21 @@ def upload(objidx, metadata, bucket, base_url, pretend=False):
     print(person, media)
     if pretend:
         return None
-    flob = client.upload_metadata(filename,
-                                  objidx,
-                                  bucket=bucket,
-                                  url=url,
-                                  library=LIBRARY,
-                                  person=person,
-                                  media=media,
-                                  extra={f"{LIBRARY}-info": metadata},
-                                  mtime=mtime)
-    print(flob.uuid)
-    return flob
+    return client.metadata_job(filename,
+                               bucket=bucket,
+                               url=url,
+                               library=LIBRARY,
+                               person=person,
+                               media=media,
+                               extra={f"{LIBRARY}-info": metadata},
+                               mtime=mtime)
 
 def _cli():
     parser = argparse.ArgumentParser(description="Object Index SI uploader")
     parser.add_argument('-b', '--bucket')
     parser.add_argument('-u', '--base-url')
     parser.add_argument('-p', '--pretend', action='store_true')
+    cli.add_pipeline_args(parser)
     parser.add_argument('filename')
     oi_url = os.environ['OBJIDX_URL']
     oi_user = os.environ['OBJIDX_AUTH'].partition(':')[0]
@@ -54,8 +53,9 @@ def _cli():
     with open(args.filename, encoding="utf-8") as user_file:
         parsed_json = json.load(user_file)
     objidx = client.get_obj_idx(oi_url, oi_user)
-    for media in parsed_json:
-        upload(objidx, media, args.bucket, args.base_url, args.pretend)
+    jobs = (upload(media, args.bucket, args.base_url, args.pretend) for media in parsed_json)
+    if cli.run_pipeline(objidx, (job for job in jobs if job), args):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""Stress POST /upload/ with many threads registering the same checksums at once
+
+Nothing is written to S3, but the index at OBJIDX_URL gets the made up objects
+(left deleted at the end) so point it at a scratch database. Checks that:
+ - each checksum ends up as exactly one object
+ - exactly one thread is told to upload it, all others get a conflict
+ - after marking the objects deleted, exactly one thread gets to restart each
+"""
+
+import argparse
+import collections
+import os
+import random
+import threading
+import requests
+from obj_idx import clilib
+
+
+def register(objidx, checksums, bucket, thread, batch, tally, lock):
+    """Register every checksum once, in random order, counting the outcomes"""
+    uploads = [{'url': f"file://stress/thread{thread}/{checksum.hex()}",
+                'bucket': bucket,
+                'obj_size': 1,
+                'checksum': checksum,
+                'filename': 'stress'}
+               for checksum in random.sample(checksums, len(checksums))]
+    outcomes = []
+    if batch:
+        for start in range(0, len(uploads), batch):
+            chunk = uploads[start:start + batch]
+            for upload, (fileobj, conflict, error) in zip(chunk, objidx.initiate_uploads(chunk)):
+                outcomes.append((upload['checksum'], 'error' if error else
+                                 'conflict' if conflict else
+                                 'exists' if fileobj.exists() else 'upload'))
+    else:
+        for upload in uploads:
+            try:
+                fileobj = objidx.initiate_upload(**upload)
+            except requests.HTTPError as e:
+                if e.response.status_code != 409:
+                    raise e
+                outcomes.append((upload['checksum'], 'conflict'))
+                continue
+            outcomes.append((upload['checksum'], 'exists' if fileobj.exists() else 'upload'))
+    with lock:
+        for checksum, status in outcomes:
+            tally[checksum][status] += 1
+
+def race(objidx, checksums, args):
+    """Run all threads at once and return per checksum Counters of statuses"""
+    tally = collections.defaultdict(collections.Counter)
+    lock = threading.Lock()
+    threads = [threading.Thread(target=register,
+                                args=(objidx, checksums, args.bucket, i, args.batch, tally, lock))
+               for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return tally
+
+def check(name, objidx, checksums, tally):
+    """Verify one object per checksum and a single winner each; return the objects"""
+    objects = {}
+    bad = 0
+    for checksum in checksums:
+        found = objidx.search_object(checksum.hex())
+        if len(found) != 1 or tally[checksum]['upload'] != 1:
+            bad += 1
+            print(name, checksum.hex(), len(found), 'objects', dict(tally[checksum]))
+        objects[checksum] = found[0]
+    print(f"{name}: {len(checksums)} checksums, {bad} bad,",
+          dict(sum(tally.values(), collections.Counter())))
+    return objects, bad
+
+def _cli():
+    parser = argparse.ArgumentParser(description="Object Index concurrent upload stress test")
+    parser.add_argument('-t', '--threads', type=int, default=16)
+    parser.add_argument('-n', '--checksums', type=int, default=50)
+    parser.add_argument('-b', '--batch', type=int, default=0,
+                        help="register via /upload/batch in chunks of this size")
+    parser.add_argument('bucket')
+    args = parser.parse_args()
+    objidx = clilib.ObjectIndex(os.environ['OBJIDX_URL'], user='stress', sw='stress',
+                                pool_size=args.threads)
+    checksums = [os.urandom(32) for _ in range(args.checksums)]
+    objects, bad = check('first', objidx, checksums, race(objidx, checksums, args))
+    for obj in objects.values():
+        objidx.put(f"object/{obj['uuid']}/", json={'deleted': True})
+    objects, bad_restart = check('restart', objidx, checksums, race(objidx, checksums, args))
+    for obj in objects.values():
+        objidx.put(f"object/{obj['uuid']}/", json={'deleted': True})
+    if bad or bad_restart:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    _cli()
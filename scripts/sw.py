@@ -5,14 +5,14 @@
 import pathlib
 import string
 import os
+import sys
 import argparse
-import warnings
-from obj_idx import client
+from obj_idx import client, cli
 
 LIBRARY = 'SSW'
 
-def one_file(objidx, filename, bucket, base_url, pretend=False):
-    """upload one file"""
+def one_file(filename, bucket, base_url, pretend=False):
+    """Prepare upload job for one file"""
     path = pathlib.Path(filename)
     url = base_url + path.name
     media = path.stem.removeprefix(LIBRARY.lower()).removesuffix('-HD')
@@ -20,19 +20,13 @@ def one_file(objidx, filename, bucket, base_url, pretend=False):
     print(filename, url, person, media)
     if pretend:
         return None
-    flob = client.upload_metadata(filename=filename,
-                                  obj_idx=objidx,
-                                  bucket=bucket,
-                                  url=url,
-                                  direct=False,
-                                  library=LIBRARY,
-                                  person=person,
-                                  media=media)
-    if not flob:
-        warnings.warn(f"Possible conflict for {filename}; upload failed")
-        return None
-    print(flob.uuid)
-    return flob
+    return client.metadata_job(filename=filename,
+                               bucket=bucket,
+                               url=url,
+                               direct=False,
+                               library=LIBRARY,
+                               person=person,
+                               media=media)
 
 
 def _cli():
@@ -40,13 +34,16 @@ def _cli():
     parser.add_argument('-b', '--bucket', required=True)
     parser.add_argument('-p', '--pretend', action='store_true')
     parser.add_argument('-u', '--base-url', required=True)
+    cli.add_pipeline_args(parser)
     parser.add_argument('filename', nargs='+')
     oi_url = os.environ['OBJIDX_URL']
     oi_user = os.environ['OBJIDX_AUTH'].partition(':')[0]
     args = parser.parse_args()
     objidx = client.get_obj_idx(oi_url, oi_user)
-    for filename in args.filename:
-        one_file(objidx, filename, args.bucket, args.base_url, args.pretend)
+    jobs = (one_file(filename, args.bucket, args.base_url, args.pretend)
+            for filename in args.filename)
+    if cli.run_pipeline(objidx, (job for job in jobs if job), args):
+        sys.exit(1)
 
 
 
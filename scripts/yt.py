@@ -4,79 +4,34 @@
 
 import argparse
 import os
-import json
+import sys
 import pathlib
 import warnings
-import datetime
-from obj_idx import client
+from obj_idx import client, cli
 
 
-def read_info_json(filename):
-    """Return data from a JSON file"""
-    with open(filename, encoding="utf-8") as user_file:
-        parsed_json = json.load(user_file)
-    return parsed_json
-
-def upload(objidx, metadata, filename, bucket, pretend=False, partial=False, library=None):
-    """Upload a given file based on JSON metadata"""
-    url = metadata.get('webpage_url')
-    if not (url and url.startswith('http')):
-        url = metadata.get('url')
-    assert url.startswith('http')
-    person = None
-    media = None
-    if library:
-        person = metadata.get('uploader')
-        if metadata.get('creator'):
-            person = metadata.get('creator')
-        if partial:
-            assert person
-            starttime = datetime.datetime.utcfromtimestamp(metadata['timestamp']).isoformat()
-            media = f'live-{person}-{starttime}-{metadata.get("id")}'
-        else:
-            if person:
-                media = f'vid-{person}-{metadata.get("id")}'
-            else:
-                media = metadata.get("id")
+def upload(metadata, filename, bucket, pretend=False, partial=False, library=None):
+    """Prepare upload job for a given file based on JSON metadata"""
+    url, person, media = client.ytdl_metadata(metadata, partial, library)
     print(filename, url, person, media)
     if pretend:
         return None
-    flob = client.upload_metadata(filename,
-                                  objidx,
-                                  bucket=bucket,
-                                  url=url,
-                                  direct=False,
-                                  partial=partial,
-                                  ytdl_info=metadata,
-                                  library=library,
-                                  person=person,
-                                  media=media)
-    if not flob:
-        warnings.warn(f"Possible conflict for {filename}; upload failed")
-        return None
-    print(flob.uuid)
-    return flob
+    return client.ytdl_job(metadata, filename, bucket, partial, library)
 
-def do_info_json(objidx, info_json, bucket, pretend=False, partial=False, library=None):
+def do_info_json(info_json, bucket, pretend=False, partial=False, library=None):
     """Given a .info.json file, parse it and upload with relevant metadata
 
     Partial should be specified for live or whenever a URL is not fully captured
 
     Specify library if uploader is a person
     """
-    parsed_json = read_info_json(info_json)
-    if parsed_json.get('_type') == 'playlist':
-        warnings.warn(f"Skipping playlist {info_json}")
-        return
-    extension = parsed_json.get('ext')
-    assert extension
-    base_file_name = info_json.removesuffix('.info.json')
-    assert base_file_name != info_json
-    media_file = base_file_name + "." + extension
+    metadata, media_file = client.info_json_media(info_json)
+    if not metadata:
+        return None
     if not pathlib.Path(media_file).exists():
         warnings.warn(f"Skipping nonexistant file {media_file}")
-        return
-    upload(objidx, parsed_json, media_file, bucket, pretend, partial, library)
+        return None
+    return upload(metadata, media_file, bucket, pretend, partial, library)
 
 
 def _cli():
@@ -85,13 +40,16 @@ def _cli():
     parser.add_argument('-p', '--pretend', action='store_true')
     parser.add_argument('-P', '--partial', action='store_true')
     parser.add_argument('-l', '--library')
+    cli.add_pipeline_args(parser)
     parser.add_argument('filename', nargs='+')
     oi_url = os.environ['OBJIDX_URL']
     oi_user = os.environ['OBJIDX_AUTH'].partition(':')[0]
     args = parser.parse_args()
     objidx = client.get_obj_idx(oi_url, oi_user)
-    for filename in args.filename:
-        do_info_json(objidx, filename, args.bucket, args.pretend, args.partial, args.library)
+    jobs = (do_info_json(filename, args.bucket, args.pretend, args.partial, args.library)
+            for filename in args.filename)
+    if cli.run_pipeline(objidx, (job for job in jobs if job), args):
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,109 @@
+"""Object and file extra JSON: filling it in on upload and searching by it
+
+Needs OBJIDX_SETTINGS pointing at a config with a scratch database that has the
+schema loaded; rows are created and removed under a unique URL prefix.
+Run with python -m unittest discover tests
+"""
+
+import hashlib
+import os
+import unittest
+import urllib.parse
+import uuid
+
+if not os.environ.get('OBJIDX_SETTINGS'):
+    raise unittest.SkipTest('OBJIDX_SETTINGS not set; needs a scratch database')
+
+# pylint: disable=wrong-import-position
+from obj_idx import api, db, db_upgrade
+
+
+class ExtraTest(unittest.TestCase):
+    """Base creating completed objects, each with one file, and removing them after"""
+
+    def setUp(self):
+        self.base = f"test-extra/{uuid.uuid4().hex}"
+        self.context = api.app.app_context()
+        self.context.push()
+        self.client = api.app.test_client()
+
+    def tearDown(self):
+        db.db.session.rollback()
+        obj_uuids = db.db.session.query(db.File.obj_uuid).filter(
+            db.File.url.like(f"{self.base}/%"))
+        obj_uuids = [obj_uuid for obj_uuid, in obj_uuids]
+        db.File.query.filter(db.File.obj_uuid.in_(obj_uuids)).delete(synchronize_session=False)
+        db.Object.query.filter(db.Object.uuid.in_(obj_uuids)).delete(synchronize_session=False)
+        db.db.session.commit()
+        db.db.session.remove()
+        self.context.pop()
+
+    def make_file(self, name, extra_object=None, extra_file=None):
+        """A completed object with one file at base/name; returns the file"""
+        checksum = hashlib.sha256(f"{self.base}/{name}".encode()).digest()
+        my_obj = db.Object(bucket=api.app.config['OBJIDX_BUCKETS'][0],
+                           key=f"{checksum.hex()}-{name}", obj_size=len(name),
+                           checksum=checksum, completed=True, extra=extra_object)
+        db.db.session.add(my_obj)
+        db.db.session.flush()
+        my_file = db.File(obj_uuid=my_obj.uuid, url=f"{self.base}/{name}", extra=extra_file)
+        db.db.session.add(my_file)
+        db.db.session.commit()
+        return my_file
+
+
+class LegacyNullTest(ExtraTest):
+    """Rows older versions saved with a JSON null extra"""
+
+    def test_fill(self):
+        """After db_upgrade an upload fills in extra on both object and file"""
+        my_file = self.make_file('legacy')
+        obj_uuid, fil_uuid, url = my_file.obj_uuid, my_file.uuid, my_file.url
+        checksum = my_file.file_object.checksum.hex()
+        db.db.session.execute(db.db.text("UPDATE object SET extra = 'null'::jsonb WHERE uuid = :uuid"),
+                              {'uuid': obj_uuid})
+        db.db.session.execute(db.db.text("UPDATE file SET extra = 'null'::jsonb WHERE uuid = :uuid"),
+                              {'uuid': fil_uuid})
+        for statement in db_upgrade.NULL_EXTRA:
+            db.db.session.execute(db.db.text(statement))
+        db.db.session.commit()
+        response = self.client.post('/upload/', json={
+            'url': url,
+            'bucket': api.app.config['OBJIDX_BUCKETS'][0],
+            'obj_size': len('legacy'),
+            'checksum': checksum,
+            'filename': 'legacy',
+            'extra_object': {'source': 'test'},
+            'extra_file': {'track': 3}})
+        self.assertEqual(response.status_code, 201, response.get_data(as_text=True))
+        self.assertTrue(response.get_json()['exists'])
+        db.db.session.expire_all()
+        self.assertEqual(db.Object.query.get(obj_uuid).extra, {'source': 'test'})
+        self.assertEqual(db.File.query.get(fil_uuid).extra, {'track': 3})
+
+
+class ExtraFilterTest(ExtraTest):
+    """GET /file/?extra=key=value against tags stored as strings, numbers and booleans"""
+
+    def found(self, *tags):
+        """URLs of files matching all the tags, each key prefixed with this run's"""
+        response = self.client.get('/file/', query_string=urllib.parse.urlencode(
+            [('extra', f"{self.base}-{tag}") for tag in tags]))
+        self.assertEqual(response.status_code, 200, response.get_data(as_text=True))
+        return {row['url'] for row in response.get_json()}
+
+    def test_typed(self):
+        """A value reading as a number or boolean matches it stored either way"""
+        number = self.make_file('number', extra_file={f"{self.base}-track": 3,
+                                                      f"{self.base}-live": True}).url
+        text = self.make_file('text', extra_file={f"{self.base}-track": '3',
+                                                  f"{self.base}-name": 'x'}).url
+        self.assertEqual(self.found('track=3'), {number, text})
+        self.assertEqual(self.found('live=true'), {number})
+        self.assertEqual(self.found('track=3', 'live=true'), {number})
+        self.assertEqual(self.found('track=3', 'name=x'), {text})
+        self.assertEqual(self.found('track=4'), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
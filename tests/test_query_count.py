@@ -0,0 +1,102 @@
+"""SQL statements per list and detail response must not grow with the result size
+
+Needs OBJIDX_SETTINGS pointing at a config with a scratch database that has the
+schema loaded; rows are created and removed under a unique URL prefix.
+Run with python -m unittest discover tests
+"""
+
+import collections
+import hashlib
+import os
+import unittest
+import uuid
+
+if not os.environ.get('OBJIDX_SETTINGS'):
+    raise unittest.SkipTest('OBJIDX_SETTINGS not set; needs a scratch database')
+
+# pylint: disable=wrong-import-position
+import sqlalchemy
+from obj_idx import api, db
+
+SIZES = (2, 20)
+
+
+class QueryCountTest(unittest.TestCase):
+    """Count statements for GET /file/, /file/<id>/ and /object/<id>/ at two sizes"""
+
+    def setUp(self):
+        self.base = f"test-query-count/{uuid.uuid4().hex}"
+        self.context = api.app.app_context()
+        self.context.push()
+        self.client = api.app.test_client()
+        self.fixtures = {size: self.make_rows(size) for size in SIZES}
+        db.db.session.commit()
+        self.statements = 0
+        sqlalchemy.event.listen(db.db.engine, 'before_cursor_execute', self.count)
+
+    def tearDown(self):
+        sqlalchemy.event.remove(db.db.engine, 'before_cursor_execute', self.count)
+        db.db.session.rollback()
+        obj_uuids = db.db.session.query(db.File.obj_uuid).filter(
+            db.File.url.like(f"{self.base}/%"))
+        obj_uuids = [obj_uuid for obj_uuid, in obj_uuids]
+        db.File.query.filter(db.File.obj_uuid.in_(obj_uuids)).delete(synchronize_session=False)
+        db.Object.query.filter(db.Object.uuid.in_(obj_uuids)).delete(synchronize_session=False)
+        db.db.session.commit()
+        db.db.session.remove()
+        self.context.pop()
+
+    def count(self, *_):
+        """before_cursor_execute listener"""
+        self.statements += 1
+
+    def make_rows(self, size):
+        """size objects sharing one URL, the first also holding size more files
+
+        Returns the shared URL, the first object's UUID and one of its file's UUIDs
+        """
+        objects = []
+        for i in range(size):
+            checksum = hashlib.sha256(f"{self.base}/{size}/{i}".encode()).digest()
+            my_obj = db.Object(bucket='test', key=f"{checksum.hex()}-test", obj_size=i,
+                               checksum=checksum, completed=True)
+            db.db.session.add(my_obj)
+            objects.append(my_obj)
+        db.db.session.flush()
+        url = f"{self.base}/{size}/list"
+        for my_obj in objects:
+            db.db.session.add(db.File(obj_uuid=my_obj.uuid, url=url))
+        hub = [db.File(obj_uuid=objects[0].uuid, url=f"{self.base}/{size}/hub/{i}")
+               for i in range(size)]
+        db.db.session.add_all(hub)
+        db.db.session.flush()
+        return url, objects[0].uuid, hub[0].uuid
+
+    def statements_for(self, path, **params):
+        """Statements run answering one GET, with nothing served from lookup_cache"""
+        api.lookup_cache.clear()
+        self.statements = 0
+        response = self.client.get(path, query_string=params)
+        self.assertEqual(response.status_code, 200, response.get_data(as_text=True))
+        return self.statements, response.get_json()
+
+    def test_constant(self):
+        """The same statement count for either size, on each endpoint"""
+        counts = collections.defaultdict(list)
+        for size, (url, obj_uuid, fil_uuid) in self.fixtures.items():
+            statements, body = self.statements_for('/file/', url=url)
+            self.assertEqual(len(body), size)
+            counts['file list'].append(statements)
+            statements, body = self.statements_for(f'/file/{fil_uuid}/')
+            self.assertEqual(len(body['file_object']['files']), size + 1)
+            counts['file detail'].append(statements)
+            statements, body = self.statements_for(f'/object/{obj_uuid}/')
+            self.assertEqual(len(body['files']), size + 1)
+            counts['object detail'].append(statements)
+        for endpoint, found in counts.items():
+            with self.subTest(endpoint=endpoint):
+                self.assertEqual(len(set(found)), 1, f"{endpoint}: {found} for sizes {SIZES}")
+
+
+if __name__ == '__main__':
+    unittest.main()